@@ -9,18 +9,59 @@ Copyright (c) 2015 Robert Dempsey. All rights reserved.
 
 import string
 import csv
+import os
+import re
 
 # Globals we need to work with
 exclude = set(string.punctuation)
 
-# suffixes will be a dict of all the suffixes that may be part of a last name
-suffixes = {}
-for i, line in enumerate(csv.reader(open("./utils/suffixes.csv"))):
-    if i == 0:
-        headers = line
-        continue
-    if line[1]:
-        suffixes[line[0]] = line[1]
+# The suffixes table lives in utils/ next to the scoring code, wherever the code is run from
+suffixes_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils", "suffixes.csv")
+
+# suffixes will be a dict of all the suffixes that may be part of a last name, loaded the first time it's needed
+suffixes = None
+
+# A single regex matching any suffix at the end of a name, built the first time it's needed
+suffix_matcher = None
+
+# Translation table that deletes all of the punctuation in a string
+punctuation_table = str.maketrans('', '', string.punctuation)
+
+# Internal abbreviations removed from names, in the order they are removed
+internal_abbreviations = ['F/K/A', "(MAIDEN", "(FKA", "(PREVIOUSLY", "(MAIDEN NAME", "(DECEASED) C/O"]
+
+# Every internal abbreviation contains one of these, so names without them can skip the removal
+internal_abbreviation_marks = re.compile(r'[(/]')
+
+
+def load_suffixes():
+    """
+    Loads the suffixes table, once
+    :return: dict of suffix: description
+    """
+    global suffixes
+    if suffixes is None:
+        loaded = {}
+        with open(suffixes_file) as f:
+            for i, line in enumerate(csv.reader(f)):
+                if i == 0:
+                    continue
+                if line[1]:
+                    loaded[line[0]] = line[1]
+        suffixes = loaded
+    return suffixes
+
+
+def get_suffix_matcher():
+    """
+    Builds the suffix regex, once: a space followed by any of the suffixes at the very end of the name,
+    longest suffixes first so that the longest one that matches is the one removed
+    """
+    global suffix_matcher
+    if suffix_matcher is None:
+        alternatives = "|".join(re.escape(suffix) for suffix in sorted(load_suffixes(), key=len, reverse=True))
+        suffix_matcher = re.compile(r'(?<= )(?:{})\Z'.format(alternatives or "(?!)"))
+    return suffix_matcher
 
 
 def remove_punctuation(x):
@@ -29,7 +70,7 @@ def remove_punctuation(x):
     x: any string
     """
     try:
-        x = ''.join(ch for ch in x if ch not in exclude)
+        x = x.translate(punctuation_table)
     except:
         pass
     return x
@@ -41,9 +82,7 @@ def remove_suffixes(x):
     x: any string
     """
     try:
-        for suffix, description in suffixes.items():
-            if x.endswith(" " + suffix):
-                x = x[:-len(suffix)]
+        x = get_suffix_matcher().sub("", x)
     except:
         pass
     return x
@@ -67,7 +106,42 @@ def remove_internal_abbreviations(x):
     x: any string
     """
     try:
-        x = x.replace('F/K/A', "").replace("(MAIDEN", "").replace("(FKA", "").replace("(PREVIOUSLY", "").replace("(MAIDEN NAME", "").replace("(DECEASED) C/O", "")
+        for abbreviation in internal_abbreviations:
+            x = x.replace(abbreviation, "")
     except:
         pass
     return x
+
+
+def clean_name(x, abbreviations=False, suffix_matcher=None):
+    """
+    Helper function to run the cleaners above on a name in one go: internal abbreviations (optional),
+    punctuation, suffixes (optional) and whitespace, in that order
+    x: a string
+    suffix_matcher: the suffix regex (see get_suffix_matcher) to remove suffixes with, or None to keep them
+    """
+    if abbreviations and internal_abbreviation_marks.search(x):
+        for abbreviation in internal_abbreviations:
+            x = x.replace(abbreviation, "")
+
+    x = x.translate(punctuation_table)
+
+    if suffix_matcher is not None:
+        x = suffix_matcher.sub("", x)
+
+    return "".join(x.split())
+
+
+def clean_frame(df, columns, abbreviations=False, suffix_matcher=None):
+    """
+    Cleans the name columns of a data frame with clean_name, one pass per column
+    Values that aren't strings (such as NaN) are left as they are, as the cleaners above do
+    df: the data frame to clean
+    columns: the columns to clean
+    abbreviations: remove internal abbreviations such as 'F/K/A'
+    suffix_matcher: the suffix regex (see get_suffix_matcher) to remove suffixes such as 'JR' with, or None
+    """
+    for column in columns:
+        df[column] = [clean_name(x, abbreviations, suffix_matcher) if isinstance(x, str) else x for x in df[column]]
+
+    return df
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+duplicate_claimants.py
+Created on 10/18/2026
+
+Finds claimants that were sent to TLO more than once under different claim numbers, in the same file or in
+files sent on other days. Claimants are put in blocks by their SSN, by their DOB and the Soundex code of their
+last name, and by the Soundex codes of their first and last names and their year of birth, and only claimants
+in the same block are compared. The blocks are kept in a SQLite index, so each new file is only compared with
+the claimants already in it rather than with the whole history.
+"""
+
+import re
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import bin.report_writers as rw
+import bin.tlo_name_checks as nc
+
+# SQLite limits the number of parameters in a query, so keys are looked up in batches of this many
+lookup_batch_size = 500
+
+# Blocks with more claimants than this (say, everyone born on 01/01/50 named Smith) aren't compared: they are
+# mostly different people and would take quadratic time
+default_max_block_size = 200
+
+# A pair of claimants is a duplicate when at least two of their SSN, DOB and name match, where names match
+# when their fuzzy name score (ratio + token sort ratio + partial ratio of the full names) is at least this
+default_name_score_threshold = 260
+
+# Normalized SSNs and DOBs that identify someone: full SSNs (not the last four digits padded with zeros)
+# and complete dates
+full_ssn = re.compile(r'[0-9]{9}')
+complete_dob = re.compile(r'[0-9]{2}/[0-9]{2}/[0-9]{2}')
+
+# The columns of the normalized TLO data the index keeps for each claimant
+claimant_columns = ['claim_number', 'first_name', 'last_name', 'full_name', 'ssn', 'date_of_birth']
+
+# The columns of the duplicates report
+duplicate_columns = ['claim_number', 'duplicate_claim_number', 'duplicate_source', 'duplicate_seen_on',
+                     'blocked_on', 'ssn_match', 'dob_match', 'name_score']
+
+soundex_codes = {}
+for letters, code in [('BFPV', '1'), ('CGJKQSXZ', '2'), ('DT', '3'), ('L', '4'), ('MN', '5'), ('R', '6'),
+                      ('AEIOUY', ''), ('HW', None)]:
+    for letter in letters:
+        soundex_codes[letter] = code
+
+
+def soundex(name):
+    """
+    Returns the (American) Soundex code of a name, such as R163 for ROBERT and RUPERT, or '' for names with no letters
+    """
+    letters = [c for c in str(name).upper() if c in soundex_codes]
+    if not letters:
+        return ''
+
+    code = letters[0]
+    last = soundex_codes[letters[0]]
+    for letter in letters[1:]:
+        digit = soundex_codes[letter]
+        # H and W don't separate letters with the same code; vowels do
+        if digit is None:
+            continue
+        if digit and digit != last:
+            code += digit
+        last = digit
+        if len(code) == 4:
+            break
+
+    return code.ljust(4, '0')
+
+
+def is_text(value):
+    return isinstance(value, str) and value != ''
+
+
+def block_keys(first_name, last_name, ssn, date_of_birth):
+    """
+    Returns the blocks a claimant belongs to
+    """
+    keys = []
+    if is_text(ssn) and full_ssn.fullmatch(ssn) and not ssn.startswith('00000'):
+        keys.append('ssn:' + ssn)
+
+    last_soundex = soundex(last_name) if is_text(last_name) else ''
+    if is_text(date_of_birth) and complete_dob.fullmatch(date_of_birth) and last_soundex:
+        keys.append('dob:{}:{}'.format(date_of_birth, last_soundex))
+
+    first_soundex = soundex(first_name) if is_text(first_name) else ''
+    if first_soundex and last_soundex and is_text(date_of_birth) and complete_dob.fullmatch(date_of_birth):
+        keys.append('name:{}:{}:{}'.format(first_soundex, last_soundex, date_of_birth[-2:]))
+
+    return keys
+
+
+class DuplicateIndex(object):
+    """
+    The index of claimants seen so far, by block
+    index_file: the SQLite file to keep the index in
+    max_block_size: blocks larger than this aren't compared
+    name_score_threshold: the fuzzy name score at which two names match
+    """
+    def __init__(self, index_file, max_block_size=default_max_block_size,
+                 name_score_threshold=default_name_score_threshold):
+        self.max_block_size = max_block_size
+        self.name_score_threshold = name_score_threshold
+        self.compared = 0
+        self.duplicates = 0
+
+        # Files analyzed at the same time (see process_tlo_files) wait for each other's writes
+        self.db = sqlite3.connect(index_file, timeout=300)
+        self.db.execute("CREATE TABLE IF NOT EXISTS claimants (id INTEGER PRIMARY KEY, claim_number TEXT, "
+                        "first_name TEXT, last_name TEXT, full_name TEXT, ssn TEXT, date_of_birth TEXT, "
+                        "source TEXT, seen_on TEXT)")
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS claimants_record ON claimants "
+                        "(claim_number, full_name, ssn, date_of_birth)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS blocks (key TEXT, claimant_id INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS blocks_key ON blocks (key)")
+        self.db.commit()
+
+    def add(self, df, source, seen_on=None):
+        """
+        Adds the claimants of normalized TLO data to the index
+        :param df: data frame with the claimant_columns
+        :param source: where the claimants come from, such as the TLO file
+        :param seen_on: when they were sent to TLO; now when None
+        :return: the ids of the claimants in the index, one per record (records already in the index keep their id)
+        """
+        seen_on = seen_on or time.strftime("%Y-%m-%d %H:%M:%S")
+        records = list(zip(*[df[column].where(df[column].notna(), None).astype(object).tolist()
+                             for column in claimant_columns]))
+
+        ids = []
+        for record in records:
+            cursor = self.db.execute("INSERT OR IGNORE INTO claimants (claim_number, first_name, last_name, full_name, "
+                                     "ssn, date_of_birth, source, seen_on) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     record + (source, seen_on))
+            if cursor.rowcount:
+                claimant_id = cursor.lastrowid
+                self.db.executemany("INSERT INTO blocks VALUES (?, ?)",
+                                    [(key, claimant_id) for key in block_keys(record[1], record[2], record[4], record[5])])
+            else:
+                claimant_id = self.db.execute("SELECT id FROM claimants WHERE claim_number IS ? AND full_name IS ? "
+                                              "AND ssn IS ? AND date_of_birth IS ?",
+                                              (record[0], record[3], record[4], record[5])).fetchone()[0]
+            ids.append(claimant_id)
+
+        self.db.commit()
+        return ids
+
+    def blocks(self, keys):
+        """
+        Looks up the claimants in blocks
+        :return: dict of key: list of claimant ids
+        """
+        found = {}
+        keys = list(set(keys))
+        for i in range(0, len(keys), lookup_batch_size):
+            batch = keys[i:i + lookup_batch_size]
+            for key, claimant_id in self.db.execute("SELECT key, claimant_id FROM blocks WHERE key IN ({})".format(
+                    ",".join("?" * len(batch))), batch):
+                found.setdefault(key, []).append(claimant_id)
+        return found
+
+    def claimants(self, ids):
+        """
+        Looks up claimants by id
+        :return: data frame of the claimants, indexed by id
+        """
+        rows = []
+        ids = list(set(ids))
+        for i in range(0, len(ids), lookup_batch_size):
+            batch = ids[i:i + lookup_batch_size]
+            rows += self.db.execute("SELECT id, claim_number, full_name, ssn, date_of_birth, source, seen_on "
+                                    "FROM claimants WHERE id IN ({})".format(",".join("?" * len(batch))), batch).fetchall()
+        return pd.DataFrame(rows, columns=['id', 'claim_number', 'full_name', 'ssn', 'date_of_birth', 'source',
+                                           'seen_on']).set_index('id')
+
+    def check(self, df, source, seen_on=None):
+        """
+        Adds the claimants of normalized TLO data to the index and finds their duplicates: claimants with another
+        claim number in the same file or in any file indexed before
+        :param df: data frame with the claimant_columns
+        :param source: where the claimants come from, such as the TLO file
+        :param seen_on: when they were sent to TLO; now when None
+        :return: data frame of the duplicates found, with the duplicate_columns
+        """
+        new_ids = self.add(df, source, seen_on)
+        claimant_blocks = self.blocks(set(key for first_name, last_name, ssn, dob in
+                                          zip(df['first_name'], df['last_name'], df['ssn'], df['date_of_birth'])
+                                          for key in block_keys(first_name, last_name, ssn, dob)))
+
+        # The candidate pairs: a claimant of this data and another claimant in the same block, each pair once
+        new = set(new_ids)
+        pairs = {}
+        for key, ids in claimant_blocks.items():
+            if len(ids) < 2 or len(ids) > self.max_block_size:
+                continue
+            ids = sorted(ids)
+            for i, id_1 in enumerate(ids):
+                for id_2 in ids[i + 1:]:
+                    if id_1 in new or id_2 in new:
+                        pairs.setdefault((id_1, id_2) if id_1 in new else (id_2, id_1), key.split(':')[0])
+
+        if not pairs:
+            return pd.DataFrame(columns=duplicate_columns)
+
+        claimants = self.claimants([claimant_id for pair in pairs for claimant_id in pair])
+        left = claimants.loc[[pair[0] for pair in pairs]]
+        right = claimants.loc[[pair[1] for pair in pairs]]
+
+        # Only pairs with different claim numbers are duplicates
+        different = left['claim_number'].values != right['claim_number'].values
+        left, right = left[different], right[different]
+        blocked_on = np.array(list(pairs.values()), dtype=object)[different]
+        self.compared += len(left)
+
+        name_scores = nc.fuzzy_feature_matrix(left['full_name'].tolist(), right['full_name'].tolist()).sum(axis=1)
+        ssn_match = (left['ssn'].values == right['ssn'].values) & \
+                    np.array([is_text(ssn) and full_ssn.fullmatch(ssn) is not None and not ssn.startswith('00000')
+                              for ssn in left['ssn']], dtype=bool)
+        dob_match = (left['date_of_birth'].values == right['date_of_birth'].values) & \
+                    np.array([is_text(dob) and complete_dob.fullmatch(dob) is not None
+                              for dob in left['date_of_birth']], dtype=bool)
+        name_match = name_scores >= self.name_score_threshold
+
+        duplicate = (ssn_match.astype(int) + dob_match + name_match) >= 2
+        self.duplicates += int(duplicate.sum())
+
+        return pd.DataFrame({
+            'claim_number': left['claim_number'].values[duplicate],
+            'duplicate_claim_number': right['claim_number'].values[duplicate],
+            'duplicate_source': right['source'].values[duplicate],
+            'duplicate_seen_on': right['seen_on'].values[duplicate],
+            'blocked_on': blocked_on[duplicate],
+            'ssn_match': ssn_match[duplicate].astype(np.uint8),
+            'dob_match': dob_match[duplicate].astype(np.uint8),
+            'name_score': name_scores[duplicate].astype(np.uint16),
+        }, columns=duplicate_columns)
+
+    def close(self):
+        self.db.close()
+
+
+def index_reports(index, base_path):
+    """
+    Adds the claimants of the reports already in the daily report folders (base_path/TLO Checks mm.dd.yy) to the
+    index, so new files are checked against them too
+    :return: the number of claimants indexed
+    """
+    indexed = 0
+    for report_file in rw.find_reports(base_path):
+        columns = [column for column in claimant_columns if column != 'full_name'] + ['sent_to_tlo_on']
+        # Read the claimant fields of CSV reports as text, so SSNs and claim numbers keep their leading zeros
+        df = rw.read_report(report_file, columns, dtype={'claim_number': str, 'ssn': str, 'date_of_birth': str})
+        df = df.astype({column: str for column in ['claim_number', 'ssn']}).where(df.notna(), None)
+        df['full_name'] = df['first_name'].astype(str) + df['last_name'].astype(str)
+        seen_on = str(df['sent_to_tlo_on'].iloc[0]) if len(df) else None
+        index.add(df, report_file, seen_on)
+        indexed += len(df)
+    return indexed
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+feature_graph.py
+Created on 10/18/2026
+
+A small executor for derived columns. Each feature declares the columns it is computed from and, optionally,
+the rows it applies to; it is then computed for those rows only and every other row gets its default.
+Features that are not stored (such as the TLO name combinations) are computed on demand, for just the rows
+of the feature asking for them, and never added to the data frame.
+"""
+
+import numpy as np
+
+
+class Feature(object):
+    """
+    A derived column, or block of columns, and how to compute it
+    name: the column name, or a list of column names when compute returns one column per name
+    inputs: the columns (or features) compute is called with, one array each
+    compute: function of the input arrays returning the feature's values for the rows it was given
+    when: (column, value) to only compute the feature for rows where column == value; all rows when None
+    default: the value of rows the feature is not computed for
+    stored: False to compute the feature on demand for the features using it instead of adding it to the data frame
+    """
+    def __init__(self, name, inputs, compute, when=None, default=0, stored=True):
+        self.name = name
+        self.inputs = list(inputs)
+        self.compute = compute
+        self.when = when
+        self.default = default
+        self.stored = stored
+
+    @property
+    def columns(self):
+        return self.name if isinstance(self.name, list) else [self.name]
+
+
+def add_columns(*columns):
+    """
+    Adds columns together row by row: joins strings, sums numbers
+    """
+    total = columns[0]
+    for column in columns[1:]:
+        total = total + column
+    return total
+
+
+def evaluate(df, features):
+    """
+    Computes the stored features in the order they are listed, along with anything they depend on,
+    and adds them to df
+    :param df: the data frame to add the features to
+    :param features: the features to compute
+    :return: df
+    """
+    by_column = {}
+    for feature in features:
+        for column in feature.columns:
+            by_column[column] = feature
+
+    def values(column, rows):
+        feature = by_column.get(column)
+        if feature is not None and not feature.stored:
+            return feature.compute(*[values(c, rows) for c in feature.inputs])
+
+        ensure(column)
+        column_values = df[column].to_numpy()
+        return column_values if rows is None else column_values[rows]
+
+    def ensure(column):
+        if column in df.columns:
+            return
+
+        feature = by_column[column]
+
+        rows = None
+        if feature.when is not None:
+            mask_column, mask_value = feature.when
+            ensure(mask_column)
+            rows = np.flatnonzero(df[mask_column].to_numpy() == mask_value)
+
+        result = np.asarray(feature.compute(*[values(c, rows) for c in feature.inputs]))
+
+        if rows is not None:
+            full = np.full((len(df),) + result.shape[1:], feature.default, dtype=result.dtype)
+            full[rows] = result
+            result = full
+
+        df[feature.name] = result
+
+    for feature in features:
+        if feature.stored:
+            for column in feature.columns:
+                ensure(column)
+
+    return df
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+feature_store.py
+Created on 10/18/2026
+
+An append-only store of the features of analyzed TLO records, so they can be rescored and analyzed without
+parsing reports again. Each column is a file of raw values that is memory-mapped when read,
+and a small manifest (manifest.json) keeps the columns, their dtypes, the number of records and where each
+batch of records came from. The manifest is only updated once a batch is fully written, so readers never see
+part of a batch.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The manifest of a store
+manifest_name = "manifest.json"
+
+# The version of the store format
+store_format_version = 1
+
+# The dtypes of the keys of the records: claim numbers as UTF-8 strings of up to 32 bytes (longer ones are
+# refused, not cut short) and the date and time the records were sent to TLO
+claim_number_dtype = 'S32'
+sent_to_tlo_on_dtype = 'datetime64[s]'
+
+
+def is_feature_store(path):
+    """
+    Returns whether a path is a feature store
+    """
+    return os.path.isfile(os.path.join(path, manifest_name))
+
+
+class FeatureStore(object):
+    """
+    A store of the features of analyzed TLO records
+    store_dir: the folder of the store; it is created on the first append
+    columns: dict of column: dtype, the columns to store. Only needed to create a store; an existing store
+             keeps the columns it was created with
+    """
+    def __init__(self, store_dir, columns=None):
+        self.store_dir = store_dir
+        self.manifest_file = os.path.join(store_dir, manifest_name)
+        self.manifest = self.read_manifest()
+
+        if self.manifest is None:
+            if columns is None:
+                raise ValueError("{} is not a feature store".format(store_dir))
+            self.manifest = {'version': store_format_version,
+                             'columns': {column: np.dtype(dtype).str for column, dtype in columns.items()},
+                             'rows': 0, 'batches': []}
+        elif columns is not None and \
+                {column: np.dtype(dtype).str for column, dtype in columns.items()} != self.manifest['columns']:
+            raise ValueError("{} stores other columns than the ones asked for; use a new store".format(store_dir))
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_file):
+            return None
+        with open(self.manifest_file) as f:
+            manifest = json.load(f)
+        if manifest['version'] != store_format_version:
+            raise ValueError("{} is version {} of the feature store format; expected version {}".format(
+                self.store_dir, manifest['version'], store_format_version))
+        return manifest
+
+    def write_manifest(self):
+        # Replace the manifest in one go, so readers see the old one or the new one and never half of one
+        temporary_file = self.manifest_file + ".tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temporary_file, self.manifest_file)
+
+    def refresh(self):
+        """
+        Reads the manifest again, to see the records appended since the store was opened
+        """
+        self.manifest = self.read_manifest() or self.manifest
+
+    @contextmanager
+    def lock(self):
+        # Processes appending at the same time (see process_tlo_files) take turns
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(os.path.join(self.store_dir, ".lock"), 'w') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @property
+    def columns(self):
+        return list(self.manifest['columns'])
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    @property
+    def batches(self):
+        """
+        The batches of records appended, in order: dict of the source, the first row, the number of rows and when
+        they were appended
+        """
+        return self.manifest['batches']
+
+    def column_file(self, column):
+        return os.path.join(self.store_dir, column + ".bin")
+
+    def append(self, df, source=None):
+        """
+        Appends records to the store
+        :param df: data frame with every column of the store
+        :param source: where the records come from, such as the TLO file
+        :return: the number of records appended
+        """
+        missing = [column for column in self.manifest['columns'] if column not in df.columns]
+        if missing:
+            raise ValueError("The records to store are missing columns: {}".format(", ".join(missing)))
+
+        # Convert every column before writing any, so records that can't be stored are refused as a whole
+        columns = {column: column_values(df[column], np.dtype(dtype), column)
+                   for column, dtype in self.manifest['columns'].items()}
+
+        with self.lock():
+            self.refresh()
+            start = self.rows
+            for column, values in columns.items():
+                with open(self.column_file(column), 'ab') as f:
+                    # Drop anything past the last full batch, left by an append that didn't finish
+                    f.truncate(start * values.itemsize)
+                    f.seek(start * values.itemsize)
+                    f.write(values.tobytes())
+
+            self.manifest['rows'] = start + len(df)
+            self.manifest['batches'].append({'source': source, 'start': start, 'rows': len(df),
+                                             'appended_on': time.strftime("%Y-%m-%d %H:%M:%S")})
+            self.write_manifest()
+
+        return len(df)
+
+    def column(self, column, start=0, stop=None):
+        """
+        Reads a column, or the slice start:stop of it, without copying it: the values are memory-mapped read-only
+        """
+        dtype = np.dtype(self.manifest['columns'][column])
+        if self.rows == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.column_file(column), dtype=dtype, mode='r', shape=(self.rows,))[start:stop]
+
+    def matrix(self, columns, start=0, stop=None, dtype=np.float64):
+        """
+        Reads the slice start:stop of some columns as a matrix, one column per column asked for. Unlike column,
+        this copies the values
+        """
+        stop = self.rows if stop is None else min(stop, self.rows)
+        matrix = np.empty((max(stop - start, 0), len(columns)), dtype=dtype)
+        for i, column in enumerate(columns):
+            matrix[:, i] = self.column(column, start, stop)
+        return matrix
+
+
+def column_values(values, dtype, column=None):
+    """
+    Converts a column of records to the dtype of a store column. Text is stored as UTF-8, and text longer than the
+    column's width is refused rather than cut short
+    """
+    if dtype.kind == 'S':
+        encoded = [value.encode('utf-8') for value in pd.Series(values).fillna('').astype(str)]
+        longest = max(encoded, key=len, default=b'')
+        if len(longest) > dtype.itemsize:
+            raise ValueError("{!r} is {} bytes long, but the {} column of the feature store holds at most {}".format(
+                longest.decode('utf-8'), len(longest), column, dtype.itemsize))
+        return np.array(encoded, dtype=dtype)
+    if dtype.kind == 'M':
+        return pd.to_datetime(pd.Series(values)).values.astype(dtype)
+    return np.asarray(values).astype(dtype)
@@ -9,8 +9,17 @@ Copyright (c) 2015 Robert Dempsey. All rights reserved.
 
 from time import strftime
 from datetime import datetime
+from functools import lru_cache
+import re
+import numpy as np
+import pandas as pd
 import bin.cleaners as clean
 
+# The DOB formats we see and the format to parse each with; see normalize_dob
+dob_formats = [(re.compile(r'[0-9]{1,2}/[0-9]{1,2}/[0-9]{2}'), '%m/%d/%y'),     # 03/03/15
+               (re.compile(r'[0-9]{1,2}/[0-9]{1,2}/[0-9]{4}'), '%m/%d/%Y'),     # 03/03/2015
+               (re.compile(r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}'), '%Y-%m-%d')]     # 2015-03-03
+
 
 def right(s, amount):
     return s[-amount:]
@@ -93,3 +102,51 @@ def normalize_dob(dob):
         pass
 
     return formatted_dob
+
+
+@lru_cache(maxsize=100000)
+def normalize_known_dob(dob):
+    """
+    Standardizes the DOB like normalize_dob, but works out its format first and parses it only with that one
+    Anything that doesn't look like one of the dob_formats is handed to normalize_dob
+    :param dob: the dob to standardize
+    :return formatted_dob
+    """
+    text = str(dob)
+
+    # Dates from TLO that end with 'XXXX' or start with 'XX'
+    if text.lower().find('x') != -1:
+        return "Incomplete"
+
+    if not text or text.lower() == "missing" or text == "nan":
+        return "MISSING"
+
+    # Dates that start with something like "0056"
+    if text[0:2] == "00":
+        text = text.replace("00", "19")
+
+    for pattern, dob_format in dob_formats:
+        if pattern.fullmatch(text):
+            if dob_format == '%Y-%m-%d' and int(text[0:4]) < 1900:
+                return "Incomplete"
+            try:
+                return datetime.strptime(text, dob_format).strftime('%m/%d/%y')
+            except ValueError:
+                break
+
+    return normalize_dob(dob)
+
+
+def normalize_dob_series(dobs):
+    """
+    Standardizes a whole column of DOBs, giving the same results as normalize_dob
+    Each distinct DOB is normalized once and the result is mapped back to every row that has it
+    :param dobs: pandas Series of dobs to standardize
+    :return: pandas Series of formatted dobs
+    """
+    positions, distinct_dobs = pd.factorize(dobs)
+
+    # Missing values (NaN) are at position -1, the last one
+    formatted_dobs = np.array([normalize_known_dob(dob) for dob in distinct_dobs] + [normalize_dob(np.nan)], dtype=object)
+
+    return pd.Series(formatted_dobs[positions], index=dobs.index, name=dobs.name)
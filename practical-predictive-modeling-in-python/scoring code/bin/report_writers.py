@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+report_writers.py
+Created on 10/18/2026
+
+Writes TLO reports as CSV, Parquet or Feather, with every column of the analysis ("full") or only the columns
+needed to act on the results ("decision"). Reports can be written a chunk at a time. Parquet and Feather need
+pyarrow; CSV reports don't.
+"""
+
+import glob
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# The report formats, their file extensions, the compression they support and the compression they use by default
+report_formats = {
+    'csv': {'extension': '.csv', 'compression': ['gzip', 'bz2', 'xz'], 'default_compression': None},
+    'parquet': {'extension': '.parquet', 'compression': ['snappy', 'gzip', 'brotli', 'lz4', 'zstd'],
+                'default_compression': 'snappy'},
+    'feather': {'extension': '.feather', 'compression': ['lz4', 'zstd'], 'default_compression': 'lz4'},
+}
+
+# The file extensions of compressed CSV reports
+csv_compression_extensions = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+# The columns needed to act on the results of the analysis: who the claimant is, what matched and the verdict
+decision_columns = ['co_type', 'claim_number', 'first_name', 'last_name', 'date_of_birth', 'ssn',
+                    'full_name_check_value', 'last_name_check_value',
+                    'ssn_match', 'dob_match', 'name_match',
+                    'failure_explanation', 'failure_explanation_numeric',
+                    'verified', 'review', 'sent_to_tlo_on']
+
+# The columns written for each column profile; None for all of them
+column_profiles = {'full': None, 'decision': decision_columns}
+
+
+def resolve_compression(report_format, compression=None):
+    """
+    Returns the compression to use for a report format: the format's default when compression is None,
+    no compression when it's 'none'
+    """
+    if compression is None:
+        return report_formats[report_format]['default_compression']
+    if compression == 'none':
+        return None
+    if compression not in report_formats[report_format]['compression']:
+        raise ValueError("{} reports can't be compressed with {}; use one of {}".format(
+            report_format, compression, ", ".join(['none'] + report_formats[report_format]['compression'])))
+    return compression
+
+
+def report_extension(report_format, compression=None):
+    """
+    Returns the file extension of a report
+    """
+    extension = report_formats[report_format]['extension']
+    if report_format == 'csv' and resolve_compression(report_format, compression):
+        extension += csv_compression_extensions[resolve_compression(report_format, compression)]
+    return extension
+
+
+class ReportWriter(object):
+    """
+    Writes a report, in one go or a chunk at a time
+    report_file: the file to write
+    report_format: csv, parquet or feather
+    columns: the column profile, full or decision (see column_profiles)
+    compression: the compression to use; the format's default when None, no compression when 'none'
+    """
+    def __init__(self, report_file, report_format='csv', columns='full', compression=None):
+        if report_format not in report_formats:
+            raise ValueError("Unknown report format: {}".format(report_format))
+        if columns not in column_profiles:
+            raise ValueError("Unknown column profile: {}".format(columns))
+        if report_format != 'csv' and pa is None:
+            raise ImportError("{} reports need pyarrow: pip install pyarrow".format(report_format))
+
+        self.report_file = report_file
+        self.report_format = report_format
+        self.columns = column_profiles[columns]
+        self.compression = resolve_compression(report_format, compression)
+        self.chunks = 0
+        self.schema = None
+        self.writer = None
+
+    def project(self, df):
+        """
+        Selects the columns of the report's column profile
+        """
+        if self.columns is None:
+            return df
+        return df[[column for column in self.columns if column in df.columns]]
+
+    def arrow_table(self, df):
+        # Text columns are always strings, even in a chunk where they are all missing, so every chunk
+        # has the same schema
+        if self.schema is None:
+            self.schema = pa.Schema.from_pandas(df, preserve_index=True)
+            for i, name in enumerate(self.schema.names):
+                if name in df.columns and df[name].dtype == object:
+                    self.schema = self.schema.set(i, pa.field(name, pa.string()))
+        return pa.Table.from_pandas(df, schema=self.schema, preserve_index=True)
+
+    def write(self, df):
+        """
+        Writes the analyzed records to the report, after any records already written
+        """
+        df = self.project(df)
+
+        if self.report_format == 'csv':
+            df.to_csv(self.report_file, sep=',', encoding='utf-8', compression=self.compression,
+                      mode='w' if self.chunks == 0 else 'a', header=(self.chunks == 0))
+
+        else:
+            table = self.arrow_table(df)
+            if self.writer is None:
+                if self.report_format == 'parquet':
+                    self.writer = pq.ParquetWriter(self.report_file, self.schema, compression=self.compression or 'none')
+                else:
+                    # Feather files are Arrow IPC files, which can be written a record batch at a time
+                    self.writer = pa.ipc.new_file(self.report_file, self.schema,
+                                                  options=pa.ipc.IpcWriteOptions(compression=self.compression))
+            self.writer.write_table(table)
+
+        self.chunks += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def find_reports(base_path):
+    """
+    Finds the reports in the daily report folders (base_path/TLO Checks mm.dd.yy), in any of the report formats
+    :return: list of report files, in name order
+    """
+    extensions = tuple(set(report_extension(report_format, compression) for report_format in report_formats
+                           for compression in [None] + report_formats[report_format]['compression']))
+    return [report_file for report_file in
+            sorted(glob.glob(os.path.join(base_path, "TLO Checks *", "tlo_check_*_check_scores.*")))
+            if report_file.endswith(extensions)]
+
+
+def read_report(report_file, columns=None, dtype=None):
+    """
+    Reads a report in any of the report formats, optionally only some of its columns
+    :param dtype: the dtypes to read the columns of a CSV report as; the other formats keep their dtypes
+    """
+    if report_file.endswith('.parquet'):
+        return pd.read_parquet(report_file, columns=columns)
+    if report_file.endswith('.feather'):
+        return pd.read_feather(report_file, columns=columns)
+    if columns is None:
+        return pd.read_csv(report_file, index_col=0, dtype=dtype)
+    # The first, unnamed, column of a CSV report is the index
+    return pd.read_csv(report_file, index_col=0, dtype=dtype,
+                       usecols=lambda c: c.startswith('Unnamed: 0') or c in columns)
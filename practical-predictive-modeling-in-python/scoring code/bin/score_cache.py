@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+score_cache.py
+Created on 10/18/2026
+
+An on-disk (SQLite) cache of scored TLO records, so claimants that are resubmitted to TLO with the same data
+aren't scored again. Records are keyed by a hash of their normalized claimant and TLO fields. The cache is
+emptied when it is opened if the scores it holds could differ from the ones the records would get now: when the
+files the scores depend on (the classifier, the suffix table), the scoring code or the scored columns change.
+Entries are evicted once they get too old or when there are too many of them (least recently used first).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# SQLite limits the number of parameters in a query, so keys are looked up in batches of this many
+lookup_batch_size = 500
+
+
+def fingerprint(files, columns, version):
+    """
+    Creates a fingerprint of the contents of the files, the columns and the version of the scoring code the cached
+    scores depend on
+    """
+    digest = hashlib.sha1()
+    for file_name in files:
+        digest.update(file_name.encode('utf-8'))
+        if os.path.exists(file_name):
+            with open(file_name, 'rb') as f:
+                digest.update(f.read())
+    digest.update(json.dumps([columns, version]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def code_version(source_files):
+    """
+    Creates a version of code from the contents of its source files, so it changes whenever the code does
+    """
+    digest = hashlib.sha1()
+    for file_name in source_files:
+        with open(file_name, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def record_keys(df, key_columns):
+    """
+    Creates the cache key of each record: a hash of the values of its key columns
+    """
+    return [hashlib.sha1('\x1f'.join(str(v) for v in values).encode('utf-8')).hexdigest()
+            for values in zip(*[df[column] for column in key_columns])]
+
+
+class ScoreCache(object):
+    """
+    The cache of scored records
+    cache_file: the SQLite file to keep the cache in
+    key_columns: the columns records are keyed on
+    columns: the columns with the scores, in order
+    depends_on: the files the scores depend on
+    version: the version of the code that computes the scores (see code_version)
+    The cache is emptied when it's opened if the columns, the files or the version changed
+    max_entries: the most records to keep; the least recently used ones are evicted first
+    max_age_days: records scored longer ago than this are evicted
+    """
+    def __init__(self, cache_file, key_columns, columns, depends_on, version, max_entries=1000000, max_age_days=90):
+        self.key_columns = key_columns
+        self.columns = list(columns)
+        self.depends_on = depends_on
+        self.fingerprint = fingerprint(depends_on, self.columns, version)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(cache_file)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, scores TEXT, created REAL, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+
+        # Empty the cache before anything is looked up if its scores could differ from the ones records get now
+        meta = dict(self.db.execute("SELECT name, value FROM meta"))
+        if meta.get('fingerprint') != self.fingerprint:
+            if 'fingerprint' in meta:
+                print("Score cache: the classifier, suffix table, scoring code or scored columns changed, "
+                      "emptying the cache")
+            self.db.execute("DELETE FROM scores")
+            self.db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                [('columns', json.dumps(self.columns)), ('fingerprint', self.fingerprint)])
+        self.db.commit()
+
+    def lookup(self, keys):
+        """
+        Looks up the scores of the records with the given keys, and marks them as used
+        :return: dict of key: list of scores, in the order of self.columns
+        """
+        found = {}
+        distinct_keys = list(set(keys))
+        for i in range(0, len(distinct_keys), lookup_batch_size):
+            batch = distinct_keys[i:i + lookup_batch_size]
+            placeholders = ",".join("?" * len(batch))
+            for key, scores in self.db.execute("SELECT key, scores FROM scores WHERE key IN ({})".format(placeholders), batch):
+                found[key] = json.loads(scores)
+            self.db.execute("UPDATE scores SET last_used = ? WHERE key IN ({})".format(placeholders), [time.time()] + batch)
+        self.db.commit()
+
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def store(self, keys, df):
+        """
+        Stores the scores of newly scored records
+        :param keys: the keys of the records
+        :param df: the scored records, with every column of self.columns
+        """
+        missing = [column for column in self.columns if column not in df.columns]
+        if missing:
+            raise ValueError("The records to cache are missing scores: {}".format(", ".join(missing)))
+
+        now = time.time()
+        rows = zip(keys, zip(*[df[column].tolist() for column in self.columns]))
+        self.db.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                            ((key, json.dumps(scores), now, now) for key, scores in rows))
+        self.db.commit()
+
+    def evict(self):
+        """
+        Evicts the records that are too old, then the least recently used ones over max_entries
+        """
+        self.db.execute("DELETE FROM scores WHERE created < ?", (time.time() - self.max_age_days * 86400,))
+        self.db.execute("DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,))
+        self.db.commit()
+
+    def close(self):
+        self.evict()
+        self.db.close()
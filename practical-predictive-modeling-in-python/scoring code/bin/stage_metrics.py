@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+stage_metrics.py
+Created on 10/18/2026
+
+Records how long each stage of a run takes (wall and CPU time), how many rows it handled and how much memory
+the process used, and writes it all out as a JSON run summary. A stage that runs more than once, such as once
+per chunk, adds up over its runs. One stage can also be profiled with cProfile.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory isn't recorded there
+    resource = None
+
+mb = 1024.0 * 1024.0
+
+
+def current_rss():
+    """
+    Returns the resident memory of this process in bytes, or None where it can't be read
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory of this process so far in bytes, or None where it can't be read
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def in_mb(size):
+    return None if size is None else round(size / mb, 1)
+
+
+class StageMetrics(object):
+    """
+    The metrics of the stages of a run
+    profile_stage: the name of the stage to profile with cProfile, if any
+    """
+    def __init__(self, profile_stage=None):
+        self.profile_stage = profile_stage
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.stages = {}
+        self.started = time.time()
+        self.started_cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        """
+        Records the metrics of the code run in the with block as a run of the named stage
+        :param name: the name of the stage
+        :param rows: the number of rows the stage handles this run; when it isn't known up front, set 'rows' in the
+                     dict the with block gets
+        """
+        run = {'rows': rows}
+        rss_before = current_rss()
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        profiling = self.profiler is not None and name == self.profile_stage
+        if profiling:
+            self.profiler.enable()
+
+        try:
+            yield run
+        finally:
+            if profiling:
+                self.profiler.disable()
+
+            wall = time.perf_counter() - wall_started
+            cpu = time.process_time() - cpu_started
+            rss_after = current_rss()
+
+            metrics = self.stages.setdefault(name, {'runs': 0, 'rows': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                                    'max_rss_increase_mb': None, 'peak_rss_mb': None})
+            metrics['runs'] += 1
+            metrics['rows'] += run['rows'] or 0
+            metrics['wall_seconds'] += wall
+            metrics['cpu_seconds'] += cpu
+            if rss_before is not None and rss_after is not None:
+                metrics['max_rss_increase_mb'] = max(metrics['max_rss_increase_mb'] or 0.0,
+                                                     in_mb(rss_after - rss_before))
+            metrics['peak_rss_mb'] = in_mb(peak_rss())
+
+    def summary(self, rows, **details):
+        """
+        Sums up the run
+        :param rows: the number of rows in the run
+        :param details: anything else to put in the summary, such as the report file
+        :return: dict with the run's totals and the metrics of each stage
+        """
+        wall = time.time() - self.started
+        stages = {}
+        for name, metrics in self.stages.items():
+            stages[name] = dict(metrics,
+                                wall_seconds=round(metrics['wall_seconds'], 4),
+                                cpu_seconds=round(metrics['cpu_seconds'], 4),
+                                rows_per_sec=round(metrics['rows'] / metrics['wall_seconds'])
+                                if metrics['rows'] and metrics['wall_seconds'] else None)
+
+        summary = dict(details)
+        summary.update({
+            'started': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            'rows': rows,
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round(time.process_time() - self.started_cpu, 4),
+            'rows_per_sec': round(rows / wall) if wall else None,
+            'peak_rss_mb': in_mb(peak_rss()),
+            'stages': stages,
+        })
+        return summary
+
+    def write_summary(self, summary_file, rows, **details):
+        """
+        Writes the run summary to a JSON file
+        :return: the run summary
+        """
+        summary = self.summary(rows, **details)
+        with open(summary_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def write_profile(self, profile_file):
+        """
+        Writes the profile of the profiled stage, if it ran, for pstats or snakeviz
+        :return: True if there was a profile to write
+        """
+        if self.profiler is None or self.profile_stage not in self.stages:
+            return False
+        self.profiler.dump_stats(profile_file)
+        return True
+
+
+def stage(metrics, name, rows=None):
+    """
+    Records a stage in metrics, or does nothing when metrics is None
+    """
+    return metrics.stage(name, rows) if metrics is not None else contextlib.nullcontext({})
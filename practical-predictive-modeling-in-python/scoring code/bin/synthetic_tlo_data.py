@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+synthetic_tlo_data.py
+Created on 10/18/2026
+
+Generates synthetic TLO files with the columns process_tlo_file expects, for benchmarking without real claimant
+data. Names get suffixes, internal abbreviations and typos, SSNs and DOBs come in the formats we see from the
+claim systems and from TLO, and TLO fields go missing at about the rates they do in real files.
+The same seed always generates the same file.
+"""
+
+import csv
+import random
+
+# The columns of a TLO file, in order
+tlo_file_columns = ['Type', 'claim_number', 'last_name', 'first_name', 'date_of_birth', 'ssn',
+                    'TloName1FirstName', 'TloName1MiddleName', 'TloName1LastName',
+                    'TloName2FirstName', 'TloName2MiddleName', 'TloName2LastName',
+                    'TloSSN', 'TloDateOfBirth']
+
+first_names = ['JAMES', 'MARY', 'ROBERT', 'PATRICIA', 'JOHN', 'JENNIFER', 'MICHAEL', 'LINDA', 'DAVID', 'ELIZABETH',
+               'WILLIAM', 'BARBARA', 'RICHARD', 'SUSAN', 'JOSEPH', 'JESSICA', 'THOMAS', 'SARAH', 'CARLOS', 'MARIA',
+               'LUIS', 'ANA', 'WEI', 'MIN', "D'ANDRE", 'JO ANN', 'ANNE-MARIE', 'MARY BETH', 'DESHAWN', 'NGOC']
+
+middle_names = ['A', 'B', 'C', 'J', 'L', 'M', 'R', 'ANN', 'LEE', 'MARIE', 'LYNN', 'JAMES', 'MICHAEL']
+
+last_names = ['SMITH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'GARCIA', 'MILLER', 'DAVIS', 'RODRIGUEZ',
+              'MARTINEZ', 'HERNANDEZ', 'LOPEZ', 'WILSON', 'ANDERSON', 'THOMAS', 'TAYLOR', 'MOORE', 'JACKSON',
+              'NGUYEN', 'LEE', "O'BRIEN", "O'NEIL", 'SMITH-JONES', 'VAN DYKE', 'DE LA CRUZ', 'MCDONALD',
+              'ST. JOHN', 'WASHINGTON', 'KOWALSKI', 'YAMAMOTO']
+
+suffixes = ['JR', 'SR', 'II', 'III', 'IV', 'ESQ', 'MD']
+
+# Internal abbreviations, each followed by a former last name
+internal_abbreviations = ['F/K/A', '(MAIDEN', '(FKA', '(PREVIOUSLY', '(MAIDEN NAME', '(DECEASED) C/O']
+
+# How often things happen
+suffix_rate = 0.04                  # claimant last names with a suffix
+tlo_suffix_rate = 0.02              # TLO last names with a suffix
+abbreviation_rate = 0.02            # claimant last names with an internal abbreviation
+typo_rate = 0.05                    # TLO names with a typo
+same_person_rate = 0.85             # TLO found the claimant, rather than someone else
+lower_case_rate = 0.10              # names that aren't upper case
+missing_middle_rate = 0.40          # TLO names without a middle name
+missing_second_name_rate = 0.45     # TLO found only one name
+missing_tlo_ssn_rate = 0.05
+missing_tlo_dob_rate = 0.07
+missing_dob_rate = 0.02             # claimant DOBs left blank
+partial_ssn_rate = 0.10             # SSNs with only the last four digits
+ssn_mismatch_rate = 0.05            # TLO SSNs that don't match the claimant's, when TLO found the claimant
+dob_mismatch_rate = 0.05            # TLO DOBs that don't match the claimant's, when TLO found the claimant
+
+
+def typo(name, rng):
+    """
+    Makes a single typo in a name: drops, doubles, swaps or replaces a letter
+    """
+    if len(name) < 3:
+        return name
+    i = rng.randrange(1, len(name) - 1)
+    kind = rng.randrange(4)
+    if kind == 0:
+        return name[:i] + name[i + 1:]
+    if kind == 1:
+        return name[:i] + name[i] + name[i:]
+    if kind == 2:
+        return name[:i - 1] + name[i] + name[i - 1] + name[i + 1:]
+    return name[:i] + rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') + name[i + 1:]
+
+
+def cased(name, rng):
+    return name.title() if rng.random() < lower_case_rate else name
+
+
+def claimant_dob(year, month, day, rng):
+    """
+    A DOB as the claim systems send it
+    """
+    r = rng.random()
+    if r < missing_dob_rate:
+        return ''
+    if r < 0.35:
+        return '{:02d}/{:02d}/{:02d}'.format(month, day, year % 100)
+    if r < 0.75:
+        return '{}/{}/{}'.format(month, day, year)
+    return '{}-{:02d}-{:02d}'.format(year, month, day)
+
+
+def tlo_dob(year, month, day, rng):
+    """
+    A DOB as TLO sends it, sometimes incomplete or out of range
+    """
+    r = rng.random()
+    if r < missing_tlo_dob_rate:
+        return ''
+    if r < 0.10:
+        return 'XX/XX/{}'.format(year)
+    if r < 0.12:
+        return '00{:02d}-{:02d}-{:02d}'.format(year % 100, month, day)
+    if r < 0.13:
+        return '1850-01-01'
+    if r < 0.55:
+        return '{}/{}/{}'.format(month, day, year)
+    return '{}-{:02d}-{:02d}'.format(year, month, day)
+
+
+def formatted_ssn(ssn, rng):
+    """
+    An SSN with or without dashes, or only its last four digits
+    """
+    r = rng.random()
+    if r < partial_ssn_rate:
+        return ssn[-4:]
+    if r < 0.40:
+        return '{}-{}-{}'.format(ssn[:3], ssn[3:5], ssn[5:])
+    return ssn
+
+
+def random_dob(rng):
+    return rng.randint(1930, 2000), rng.randint(1, 12), rng.randint(1, 28)
+
+
+def random_ssn(rng):
+    return '{:09d}'.format(rng.randint(1000000, 999999999))
+
+
+def tlo_name(first, middle, last, rng):
+    """
+    A name as TLO found it: sometimes with a typo, a suffix or no middle name
+    """
+    if rng.random() < typo_rate:
+        first = typo(first, rng)
+    if rng.random() < typo_rate:
+        last = typo(last, rng)
+    if rng.random() < tlo_suffix_rate:
+        last = '{} {}'.format(last, rng.choice(suffixes))
+    if rng.random() < missing_middle_rate:
+        middle = ''
+    return [cased(first, rng), middle, cased(last, rng)]
+
+
+def generate_tlo_records(rows, seed=1, first_claim_number=100000):
+    """
+    Generates the records of a synthetic TLO file, one list of values per record (see tlo_file_columns)
+    :param rows: the number of records
+    :param seed: the random seed
+    :param first_claim_number: the claim number of the first record
+    """
+    rng = random.Random(seed)
+
+    for i in range(rows):
+        first, middle, last = rng.choice(first_names), rng.choice(middle_names), rng.choice(last_names)
+        year, month, day = random_dob(rng)
+        ssn = random_ssn(rng)
+
+        # The claimant, as the claim system has them
+        claimant_last = last
+        if rng.random() < suffix_rate:
+            claimant_last = '{} {}'.format(claimant_last, rng.choice(suffixes))
+        if rng.random() < abbreviation_rate:
+            claimant_last = '{} {} {}'.format(claimant_last, rng.choice(internal_abbreviations), rng.choice(last_names))
+
+        # Who TLO found
+        if rng.random() < same_person_rate:
+            tlo_ssn = ssn if rng.random() >= ssn_mismatch_rate else random_ssn(rng)
+            tlo_date = (year, month, day) if rng.random() >= dob_mismatch_rate else random_dob(rng)
+            name_1 = tlo_name(first, middle, last.split(' ')[0] if rng.random() < 0.5 else last, rng)
+        else:
+            tlo_ssn, tlo_date = random_ssn(rng), random_dob(rng)
+            name_1 = tlo_name(rng.choice(first_names), rng.choice(middle_names), rng.choice(last_names), rng)
+
+        if rng.random() < missing_second_name_rate:
+            name_2 = ['', '', '']
+        else:
+            name_2 = tlo_name(rng.choice(first_names), rng.choice(middle_names),
+                              last if rng.random() < 0.5 else rng.choice(last_names), rng)
+
+        yield ([rng.choice(['CO', 'NC']), first_claim_number + i,
+                cased(claimant_last, rng), cased(first, rng), claimant_dob(year, month, day, rng),
+                formatted_ssn(ssn, rng)] +
+               name_1 + name_2 +
+               ['' if rng.random() < missing_tlo_ssn_rate else formatted_ssn(tlo_ssn, rng),
+                tlo_dob(*tlo_date, rng=rng)])
+
+
+def write_tlo_file(file_name, rows, seed=1):
+    """
+    Writes a synthetic TLO file, a record at a time so files of any size can be written
+    :param file_name: the file to write
+    :param rows: the number of records
+    :param seed: the random seed
+    """
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(tlo_file_columns)
+        writer.writerows(generate_tlo_records(rows, seed))
@@ -7,7 +7,25 @@ Updated on 05/18/2015
 Copyright (c) 2015 Robert Dempsey. All rights reserved.
 """
 
-from fuzzywuzzy import fuzz
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+# fuzzywuzzy scores with the compiled Levenshtein matcher when python-Levenshtein is installed and with difflib
+# otherwise, so the feature kernel below uses the same one to give the same scores
+_SequenceMatcher = fuzz.SequenceMatcher
+
+
+def _sequence_ratio(s1, s2):
+    return _SequenceMatcher(None, s1, s2).ratio()
+
+# The scores computed for each pair of names, in the order they appear in the report
+fuzzy_scorers = ['ratio', 'token_sort_ratio', 'partial_ratio']
+
+# The name feature columns, three for each of the 14 TLO name combinations
+name_feature_columns = ['name_{}_{}'.format(k, scorer) for k in range(1, 15) for scorer in fuzzy_scorers]
+
+# How many fuzzy scores the feature kernel was asked for, and how many it computed once repeated pairs were removed
+dedupe_stats = {'pairs': 0, 'scored': 0}
 
 
 def exact_name_check(name_to_test, parts):
@@ -53,6 +71,28 @@ def last_name_to_check_inner(tlo_last_name, last_name_to_check):
     return 0
 
 
+def exact_name_checks(names_to_test, *part_columns):
+    """
+    Runs exact_name_check on whole columns: each name against the parts in the same row of part_columns
+    :param names_to_test: the names to test
+    :param part_columns: one column per part, each aligned with names_to_test
+    :return: an int8 array of 1 where the name comprises a subset of its parts, 0 elsewhere
+    """
+    return np.fromiter((exact_name_check(name, parts) for name, parts in zip(names_to_test, zip(*part_columns))),
+                       dtype=np.int8, count=len(names_to_test))
+
+
+def last_name_checks(tlo_last_names_1, tlo_last_names_2, last_names_to_check):
+    """
+    Runs last_name_check on whole columns
+    :return: an int8 array of 1 where either TLO last name is, contains or is part of the last name, 0 elsewhere
+    """
+    return np.fromiter((last_name_check(tlo_last_name_1, tlo_last_name_2, last_name)
+                        for tlo_last_name_1, tlo_last_name_2, last_name
+                        in zip(tlo_last_names_1, tlo_last_names_2, last_names_to_check)),
+                       dtype=np.int8, count=len(last_names_to_check))
+
+
 def fuzzy_ratio(thing_1, thing_2):
   """
   Runs a simple fuzzy ratio check
@@ -104,4 +144,145 @@ def fuzzy_partial_ratio_check(full_name_check_value, name_one, name_two):
     if full_name_check_value == 0:
         return fuzz.partial_ratio(name_one, name_two)
     
-    return 0
\ No newline at end of file
+    return 0
+
+
+##
+# Feature kernel: the same scores as the functions above, computed for whole columns in one pass
+##
+
+def _ratio(s1, s2):
+    """
+    fuzz.ratio for two strings
+    """
+    if s1 == s2:
+        return 100
+    if not s1 or not s2:
+        return 0
+    return utils.intr(100 * _sequence_ratio(s1, s2))
+
+
+def _partial_ratio(s1, s2):
+    """
+    fuzz.partial_ratio for two strings
+    """
+    if s1 == s2:
+        return 100
+    if not s1 or not s2:
+        return 0
+
+    if len(s1) <= len(s2):
+        shorter, longer = s1, s2
+    else:
+        shorter, longer = s2, s1
+
+    best = 0
+    for block in _SequenceMatcher(None, shorter, longer).get_matching_blocks():
+        long_start = max(block[1] - block[0], 0)
+        r = _sequence_ratio(shorter, longer[long_start:long_start + len(shorter)])
+        if r > .995:
+            return 100
+        best = max(best, r)
+    return utils.intr(100 * best)
+
+
+def _sorted_tokens(s):
+    """
+    The processed, token sorted form of a string that fuzz.token_sort_ratio compares
+    """
+    return " ".join(sorted(utils.full_process(s, force_ascii=True).split())).strip()
+
+
+class _FuzzyPairScorer(object):
+    """
+    Scores pairs of things with the ratio, token sort ratio and partial ratio, scoring each distinct pair only once
+    """
+    def __init__(self):
+        self.sorted_forms = {}
+        self.pair_scores = {}
+        self.token_sort_scores = {}
+        self.pairs = 0
+        self.unmatched = 0
+
+    def sorted_form(self, s):
+        if s not in self.sorted_forms:
+            self.sorted_forms[s] = _sorted_tokens(s)
+        return self.sorted_forms[s]
+
+    def scores(self, thing_1, thing_2):
+        self.pairs += len(fuzzy_scorers)
+
+        if not isinstance(thing_1, str) or not isinstance(thing_2, str):
+            self.unmatched += len(fuzzy_scorers)
+            return [fuzz.ratio(thing_1, thing_2), fuzz.token_sort_ratio(thing_1, thing_2), fuzz.partial_ratio(thing_1, thing_2)]
+
+        pair = (thing_1, thing_2)
+        if pair not in self.pair_scores:
+            self.pair_scores[pair] = (_ratio(thing_1, thing_2), _partial_ratio(thing_1, thing_2))
+        ratio, partial_ratio = self.pair_scores[pair]
+
+        sorted_pair = (self.sorted_form(thing_1), self.sorted_form(thing_2))
+        if sorted_pair not in self.token_sort_scores:
+            self.token_sort_scores[sorted_pair] = _ratio(*sorted_pair)
+
+        return [ratio, self.token_sort_scores[sorted_pair], partial_ratio]
+
+    def record_stats(self):
+        """
+        Adds the pairs asked for and the pairs actually scored to dedupe_stats
+        """
+        dedupe_stats['pairs'] += self.pairs
+        dedupe_stats['scored'] += 2 * len(self.pair_scores) + len(self.token_sort_scores) + self.unmatched
+
+
+def take_dedupe_stats():
+    """
+    Returns how many fuzzy scores the feature kernel was asked for and how many it had to compute,
+    and starts counting again
+    """
+    stats = dict(dedupe_stats)
+    dedupe_stats.update(pairs=0, scored=0)
+    return stats
+
+
+def fuzzy_feature_matrix(things_1, things_2):
+    """
+    Runs the fuzzy ratio, token sort ratio and partial ratio checks on two aligned columns
+    Repeated pairs are only scored once
+    Returns a uint8 array (scores are 0 to 100) with one row per pair and one column per score (see fuzzy_scorers)
+    """
+    features = np.zeros((len(things_1), len(fuzzy_scorers)), dtype=np.uint8)
+    scorer = _FuzzyPairScorer()
+
+    for i, (thing_1, thing_2) in enumerate(zip(things_1, things_2)):
+        features[i] = scorer.scores(thing_1, thing_2)
+
+    scorer.record_stats()
+    return features
+
+
+def name_feature_matrix(full_names, name_combos, full_name_check_values=None):
+    """
+    Runs the fuzzy checks of each full name against all of its TLO name combinations in one pass over the records
+    Each distinct (full name, combination) pair is scored once, however many times it appears within a record
+    or across records, and each name is processed and token sorted once
+    Records that passed the full name check score 0, the same as fuzzy_ratio_check and its siblings
+    :param full_names: the full names to check
+    :param name_combos: one column per TLO name combination, each aligned with full_names
+    :param full_name_check_values: the full name check of each record; all records are checked when None
+    :return: a uint8 array with one row per record and the columns listed in name_feature_columns
+    """
+    features = np.zeros((len(full_names), len(fuzzy_scorers) * len(name_combos)), dtype=np.uint8)
+    scorer = _FuzzyPairScorer()
+
+    for i, (full_name, combos) in enumerate(zip(full_names, zip(*name_combos))):
+        if full_name_check_values is not None and full_name_check_values[i] != 0:
+            continue
+
+        scores = []
+        for combo in combos:
+            scores += scorer.scores(full_name, combo)
+        features[i] = scores
+
+    scorer.record_stats()
+    return features
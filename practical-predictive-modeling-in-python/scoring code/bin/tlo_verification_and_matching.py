@@ -7,7 +7,297 @@ Updated by Robert Dempsey on 07/29/2015
 
 """
 
+import hashlib
+import json
+import os
 import pickle
+import numpy as np
+
+
+# The folder of the trained models, wherever the scoring code is run from
+models_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+
+# The trained model, as pickled by the "TLO Validation With Logistic Regression" notebook
+pickled_classifier_file = os.path.join(models_dir, "tlo_lr_classifier_07.28.15.dat")
+
+# The trained model exported to plain arrays (see export_classifier), which can be scored without scikit-learn
+exported_classifier_file = os.path.join(models_dir, "tlo_lr_classifier_07.28.15.npz")
+
+# The version of the exported model format. Version 2 keeps the SHA-256 of the model it was exported from
+classifier_format_version = 2
+
+# The trained model used to verify records: the exported model when there is one, the pickled model otherwise.
+# An exported model that no longer matches the pickled model it was exported from refuses to load
+tlo_classifier_file = exported_classifier_file if os.path.exists(exported_classifier_file) else pickled_classifier_file
+
+# The name scores, one per TLO name combination
+name_score_columns = ['n{}_score'.format(i) for i in range(1, 15)]
+
+# The record scores the model was trained on, in the order it expects them
+model_features = ['full_name_check_value', 'ssn_score', 'dob_score'] + name_score_columns + \
+                 ['ssn_match', 'dob_match', 'name_match', 'failure_explanation_numeric', 'last_name_check_value']
+
+# Failure explanations indexed by the checks a record failed: SSN = 4, DOB = 2, NAME = 1
+failure_explanations = np.array(["", "NAME", "DOB", "DOB NAME", "SSN", "SSN NAME", "SSN DOB", "SSN DOB NAME"], dtype=object)
+
+# Failure explanations as numbers, see convert_failure_explanation_to_number
+failure_explanation_numbers = {'dob': 0, 'name': 1, 'ssn dob name': 2, 'ssn': 3, 'ssn name': 4, 'ssn dob': 5, 'dob name': 6}
+
+# The number of each failure explanation, indexed like failure_explanations
+failure_code_numbers = np.array([failure_explanation_numbers.get(explanation.lower(), 0)
+                                 for explanation in failure_explanations], dtype=np.uint8)
+
+# Models already loaded by this process, keyed by file name
+_classifiers = {}
+
+# The rules that verify records without the classifier in cascade mode, see calibrate_cascade
+cascade_rules_file = os.path.join(models_dir, "tlo_cascade_rules.json")
+
+# The checks that decide which cell of the cascade a record falls in: cell = ssn_match * 4 + dob_match * 2 + name_match
+cascade_checks = ['ssn_match', 'dob_match', 'name_match']
+
+# How many records went through the cascade and how many of them it verified without the classifier
+cascade_stats = {'records': 0, 'skipped': 0}
+
+
+class LinearClassifier(object):
+    """
+    A logistic regression classifier exported from scikit-learn, scored with a single matrix-vector product
+    coef: the coefficients, one per feature
+    intercept: the intercept
+    classes: the class labels: classes[0] when the decision is <= 0, classes[1] when it is > 0
+    features: the names of the features, in the order the coefficients expect them
+    source_file: the model it was exported from, if any
+    source_sha256: the SHA-256 of source_file when it was exported
+    """
+    def __init__(self, coef, intercept, classes, features, source_file='', source_sha256=''):
+        self.coef = np.asarray(coef, dtype=float).ravel()
+        self.intercept = float(intercept)
+        self.classes = np.asarray(classes)
+        self.features = list(features)
+        self.source_file = source_file
+        self.source_sha256 = source_sha256
+
+    def decision_function(self, feature_matrix):
+        return np.asarray(feature_matrix, dtype=float) @ self.coef + self.intercept
+
+    def predict(self, feature_matrix):
+        return self.classes[(self.decision_function(feature_matrix) > 0).astype(int)]
+
+
+def file_sha256(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_classifier(classifier, export_file=exported_classifier_file, source_file=None):
+    """
+    Saves the coefficients, intercept and class labels of a trained (binary) logistic regression classifier,
+    with the feature order and the format version, to an .npz file that can be scored without scikit-learn
+    :param classifier: the trained classifier, such as the pickled model
+    :param export_file: the file to save it to
+    :param source_file: the file the classifier was loaded from; its SHA-256 is saved, so the export refuses
+                        to load once that file changes
+    :return: the exported classifier, as a LinearClassifier
+    """
+    if np.asarray(classifier.coef_).shape != (1, len(model_features)):
+        raise ValueError("Expected a binary classifier with {} features, got coefficients of shape {}".format(
+            len(model_features), np.asarray(classifier.coef_).shape))
+
+    exported = LinearClassifier(classifier.coef_, np.asarray(classifier.intercept_).ravel()[0], classifier.classes_,
+                                model_features,
+                                # Where the source is, relative to the export, so the two can be moved together
+                                os.path.relpath(os.path.abspath(source_file),
+                                                os.path.dirname(os.path.abspath(export_file))) if source_file else '',
+                                file_sha256(source_file) if source_file else '')
+    save_classifier(exported, export_file)
+
+    return exported
+
+
+def save_classifier(classifier, export_file=exported_classifier_file):
+    """
+    Saves a LinearClassifier to an .npz file, see load_exported_classifier
+    """
+    with open(export_file, "wb") as f:
+        np.savez(f, version=classifier_format_version, coef=classifier.coef, intercept=classifier.intercept,
+                 classes=classifier.classes, features=np.array(classifier.features),
+                 source_file=np.array(classifier.source_file), source_sha256=np.array(classifier.source_sha256))
+
+
+def load_exported_classifier(export_file=exported_classifier_file):
+    """
+    Loads a classifier saved by export_classifier, refusing it when the model it was exported from has changed
+    since (export it again with tlo_model.py export)
+    :return: the classifier, as a LinearClassifier
+    """
+    with np.load(export_file, allow_pickle=False) as saved:
+        if int(saved['version']) != classifier_format_version:
+            raise ValueError("{} is version {} of the exported model format; expected version {}".format(
+                export_file, int(saved['version']), classifier_format_version))
+        if saved['features'].tolist() != model_features:
+            raise ValueError("{} was exported with features {}; expected {}".format(
+                export_file, saved['features'].tolist(), model_features))
+        classifier = LinearClassifier(saved['coef'], saved['intercept'], saved['classes'], saved['features'].tolist(),
+                                      str(saved['source_file']), str(saved['source_sha256']))
+
+    if classifier.source_file:
+        source_file = os.path.join(os.path.dirname(os.path.abspath(export_file)), classifier.source_file)
+        if os.path.exists(source_file) and file_sha256(source_file) != classifier.source_sha256:
+            raise ValueError("{} was exported from {}, which has changed since; export it again with "
+                             "tlo_model.py export".format(export_file, source_file))
+
+    return classifier
+
+
+def classifier_sha256(classifier_file=tlo_classifier_file):
+    """
+    Identifies a trained model: the SHA-256 of the pickled model, which an export of it shares
+    """
+    if classifier_file.endswith(".npz"):
+        with np.load(classifier_file, allow_pickle=False) as saved:
+            if 'source_sha256' in saved.files and str(saved['source_sha256']):
+                return str(saved['source_sha256'])
+    return file_sha256(classifier_file)
+
+
+def load_classifier(classifier_file=tlo_classifier_file):
+    """
+    Loads a trained model the first time it is asked for and reuses it after that
+    :param classifier_file: the model to load: an exported model (.npz) or a pickled one
+    :return: the classifier
+    """
+    if classifier_file not in _classifiers:
+        if classifier_file.endswith(".npz"):
+            _classifiers[classifier_file] = load_exported_classifier(classifier_file)
+        else:
+            with open(classifier_file, "rb") as f:
+                _classifiers[classifier_file] = pickle.load(f)
+
+    return _classifiers[classifier_file]
+
+
+def verify_records(feature_matrix, classifier_file=tlo_classifier_file):
+    """
+    Given a matrix with the scores for many records (one row per record, columns ordered as model_features),
+    each record is either verified (1) or non-verified (0)
+    :param feature_matrix: the scores for the records
+    :param classifier_file: the model to verify with
+    :return: verifications: an array of 0 = non-verified, 1 = verified
+    """
+    feature_matrix = np.asarray(feature_matrix)
+    if len(feature_matrix) == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    return load_classifier(classifier_file).predict(feature_matrix).astype(np.uint8)
+
+
+def cascade_cells(feature_matrix):
+    """
+    Returns the cascade cell of each record: ssn_match * 4 + dob_match * 2 + name_match
+    :param feature_matrix: the scores for the records, columns ordered as model_features
+    """
+    feature_matrix = np.asarray(feature_matrix)
+    cells = np.zeros(len(feature_matrix), dtype=np.uint8)
+    for check in cascade_checks:
+        cells = cells * 2 + (feature_matrix[:, model_features.index(check)] == 1)
+    return cells
+
+
+def calibrate_cascade(feature_matrix, classifier_file=tlo_classifier_file, min_agreement=0.999, min_support=50):
+    """
+    Works out which cascade cells the classifier decides the same way for (nearly) every record, on scored records
+    such as the training data. Records in those cells can be verified by the rule without the classifier
+    :param feature_matrix: the scores for the records, columns ordered as model_features
+    :param classifier_file: the model to calibrate against
+    :param min_agreement: the share of a cell's records the classifier must decide the same way
+    :param min_support: the fewest records a cell needs to get a rule
+    :return: list with a dict per cell: the checks, the number of records, the classifier's most common
+             verification and how many of the cell's records got it, and whether the cell gets a rule
+    """
+    verifications = verify_records(feature_matrix, classifier_file)
+    cells = cascade_cells(feature_matrix)
+
+    rules = []
+    for cell in range(2 ** len(cascade_checks)):
+        in_cell = verifications[cells == cell]
+        verified = int(np.round(in_cell.mean())) if len(in_cell) else 0
+        agreement = float((in_cell == verified).mean()) if len(in_cell) else 0.0
+        rule = dict(zip(cascade_checks, [(cell >> shift) & 1 for shift in range(len(cascade_checks) - 1, -1, -1)]))
+        rule.update(records=int(len(in_cell)), verified=verified, agreement=agreement,
+                    use=bool(len(in_cell) >= min_support and agreement >= min_agreement))
+        rules.append(rule)
+
+    return rules
+
+
+def save_cascade_rules(rules, rules_file=cascade_rules_file, classifier_file=tlo_classifier_file):
+    """
+    Saves cascade rules with the model they were calibrated against, see load_cascade_rules
+    """
+    with open(rules_file, 'w') as f:
+        json.dump({'classifier_file': classifier_file, 'classifier_sha256': classifier_sha256(classifier_file),
+                   'rules': rules}, f, indent=2)
+
+
+def load_cascade_rules(rules_file=cascade_rules_file, classifier_file=tlo_classifier_file):
+    """
+    Loads the cascade rules that are in use, refusing rules calibrated against another model than the one
+    they'll be used with (calibrate them again with tlo_model.py calibrate-cascade)
+    :param classifier_file: the model the rules will be used with
+    :return: dict of cascade cell: verification
+    """
+    with open(rules_file) as f:
+        saved = json.load(f)
+    if saved.get('classifier_sha256') != classifier_sha256(classifier_file):
+        raise ValueError("The cascade rules in {} were calibrated against {}, not {}; calibrate them again with "
+                         "tlo_model.py calibrate-cascade --classifier {}".format(
+                             rules_file, saved.get('classifier_file'), classifier_file, classifier_file))
+    rules = saved['rules']
+
+    return {sum(rule[check] << shift for check, shift in zip(cascade_checks, range(len(cascade_checks) - 1, -1, -1))):
+            rule['verified'] for rule in rules if rule['use']}
+
+
+def verify_records_cascade(feature_matrix, cascade_rules, classifier_file=tlo_classifier_file):
+    """
+    Verifies records by the cascade rules where they have one for the record's cell, and with the classifier
+    for the rest
+    :param feature_matrix: the scores for the records, columns ordered as model_features
+    :param cascade_rules: dict of cascade cell: verification, see load_cascade_rules
+    :param classifier_file: the model to verify the rest with
+    :return: verifications: an array of 0 = non-verified, 1 = verified
+    """
+    feature_matrix = np.asarray(feature_matrix)
+    verifications = np.zeros(len(feature_matrix), dtype=np.uint8)
+    if len(feature_matrix) == 0:
+        return verifications
+
+    cells = cascade_cells(feature_matrix)
+    decided = np.zeros(len(feature_matrix), dtype=bool)
+    for cell, verified in cascade_rules.items():
+        in_cell = cells == cell
+        verifications[in_cell] = verified
+        decided |= in_cell
+
+    if not decided.all():
+        verifications[~decided] = verify_records(feature_matrix[~decided], classifier_file)
+
+    cascade_stats['records'] += len(feature_matrix)
+    cascade_stats['skipped'] += int(decided.sum())
+    return verifications
+
+
+def take_cascade_stats():
+    """
+    Returns how many records went through the cascade and how many skipped the classifier, and starts counting again
+    """
+    stats = dict(cascade_stats)
+    cascade_stats.update(records=0, skipped=0)
+    return stats
 
 
 def verify_record(record_scores):
@@ -16,15 +306,7 @@ def verify_record(record_scores):
     :param item: the set of scores for a record
     :return: verification: 0 = non-verified, 1 = verified
     """
-
-    # Reload the trained model
-    tlo_classifier_file = "models/tlo_lr_classifier_07.28.15.dat"
-    logClassifier = pickle.load(open(tlo_classifier_file, "rb"))
-
-    # Return the prediction
-    return logClassifier.predict(record_scores)[0]
-    # print(logClassifier.predict(record_scores)[0])
-
+    return verify_records([record_scores])[0]
 
 
 def ssn_match(ssn_score):
@@ -128,4 +410,78 @@ def convert_failure_explanation_to_number(failure_explanation):
     elif failure_explanation == 'dob name':
         return 6
     else:
-        return 0
\ No newline at end of file
+        return 0
+
+
+##
+# Column versions of the rules above: each takes whole columns (arrays) and returns an array with one value per record
+##
+
+def ssn_matches(ssn_scores):
+    """
+    Given the SSN scores of many records, each is a match (1) or not a match (0)
+    :param ssn_scores: the ssn scores to test
+    :return: matches: an array of 0 = not-match, 1 = match
+    """
+    return (np.asarray(ssn_scores) == 300).astype(np.uint8)
+
+
+def dob_matches(dob_scores):
+    """
+    Given the DOB scores of many records, each is a match (1) or not a match (0)
+    :param dob_scores: the dob scores to test
+    :return: matches: an array of 0 = not-match, 1 = match
+    """
+    return (np.asarray(dob_scores) == 300).astype(np.uint8)
+
+
+def name_matches(full_name_check_values, last_name_check_values, name_score_matrix):
+    """
+    Given the name checks and a matrix of name scores (one row per record, one column per name score),
+    a record is a match if either check passed or any of its name scores is 280 or above
+    :return: matches: an array of 0 = not-match; 1 = match
+    """
+    name_score_matrix = np.asarray(name_score_matrix)
+
+    matched = (np.asarray(full_name_check_values) == 1) | (np.asarray(last_name_check_values) == 1)
+    matched |= (name_score_matrix >= 280).any(axis=1)
+
+    return matched.astype(np.uint8)
+
+
+def determine_review_types(full_name_check_values, verifications, name_score_matrix):
+    """
+    Determines the type of review needed for many records, following the rules of determine_review_type
+    :return: review_types: an array of "" or "VISUAL"
+    """
+    name_score_matrix = np.asarray(name_score_matrix)
+
+    settled = (np.asarray(full_name_check_values) == 1) | (np.asarray(verifications) == 1)
+    settled |= (name_score_matrix >= 280).any(axis=1)
+    visual = ((name_score_matrix >= 260) & (name_score_matrix <= 279)).any(axis=1) & ~settled
+
+    return np.where(visual, "VISUAL", "").astype(object)
+
+
+def failure_codes(ssn_match_scores, dob_match_scores, name_match_scores):
+    """
+    Codes the checks each of many records failed: SSN = 4, DOB = 2, NAME = 1, added up
+    :return: a uint8 array of 0 to 7, indexing failure_explanations and failure_code_numbers
+    """
+    return ((np.asarray(ssn_match_scores) == 0) * 4 +
+            (np.asarray(dob_match_scores) == 0) * 2 +
+            (np.asarray(name_match_scores) == 0) * 1).astype(np.uint8)
+
+
+def explain_failures(ssn_match_scores, dob_match_scores, name_match_scores):
+    """
+    Explains the reason for many records failing one or more checks
+    """
+    return failure_explanations[failure_codes(ssn_match_scores, dob_match_scores, name_match_scores)]
+
+
+def convert_failure_codes_to_numbers(codes):
+    """
+    Converts the failure codes of many records (see failure_codes) to the numbers of their failure explanations
+    """
+    return failure_code_numbers[codes]
\ No newline at end of file
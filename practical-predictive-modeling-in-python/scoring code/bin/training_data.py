@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+training_data.py
+Created on 10/18/2026
+
+Loads scored TLO records, such as the data the classifier was trained on or a full report, as the feature matrix
+the classifier takes, prepared the way the "TLO Validation With Logistic Regression" notebook prepared it:
+failure explanations converted to numbers and missing scores filled in with 0. Labeled data too large to load
+at once can be streamed a chunk at a time, or saved once as .npy files that processes can memory-map and share.
+Only the reviewed training data is labeled: the verified column of a report or a feature store is the classifier's
+own verification, so they are refused as training data.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import bin.feature_store as fs
+import bin.tlo_verification_and_matching as vm
+
+# The data the classifier was trained on
+training_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                             "data", "tlo_checks_07.28.15_cleaned.csv")
+
+# The column with the verification the classifier learned
+target_column = 'verified'
+
+# A column only reports have, to tell them from labeled data
+report_column = 'sent_to_tlo_on'
+
+# The types of the columns the classifier is trained on, so pandas doesn't have to infer them for every chunk
+training_dtypes = dict({feature: np.float64 for feature in vm.model_features if feature != 'failure_explanation_numeric'},
+                       failure_explanation='category', **{target_column: np.float64})
+
+# The number of records read at a time when streaming training data
+default_chunksize = 100000
+
+
+def failure_explanation_codes(failure_explanations):
+    """
+    Converts a column of failure explanations to numbers (see vm.failure_explanation_numbers), converting each
+    distinct explanation once; missing explanations are 0
+    """
+    failure_explanations = pd.Series(failure_explanations).astype('category')
+    numbers = np.array([vm.failure_explanation_numbers.get(str(explanation).lower(), 0)
+                        for explanation in failure_explanations.cat.categories] + [0], dtype=np.uint8)
+    # Missing explanations have code -1, which picks the trailing 0
+    return numbers[failure_explanations.cat.codes.values]
+
+
+def prepare_features(df):
+    """
+    Creates the feature matrix (columns ordered as vm.model_features) of scored records, converting the failure
+    explanations to numbers when the records don't have them yet and filling in missing scores with 0
+    """
+    df = df.copy()
+    if 'failure_explanation_numeric' not in df.columns:
+        df['failure_explanation_numeric'] = failure_explanation_codes(df['failure_explanation'])
+    return df[vm.model_features].fillna(0).values.astype(float)
+
+
+def load_scored_records(data_file=training_file, usecols=None):
+    """
+    Loads scored records: the training data or a full report
+    :param data_file: the CSV file of scored records
+    :param usecols: the columns to load, all of them when None
+    :return: the records
+    """
+    return pd.read_csv(data_file, index_col=0, usecols=usecols)
+
+
+def load_training_data(data_file=training_file):
+    """
+    Loads the training data
+    :return: (feature matrix, targets), or targets None when the data isn't labeled
+    """
+    df = load_scored_records(data_file)
+    targets = df[target_column].values.astype(int) if target_column in df.columns else None
+    return prepare_features(df), targets
+
+
+def check_labeled(data_file):
+    """
+    Refuses data that isn't labeled: the records of a report or a feature store were verified by the classifier
+    itself, and training on them would only teach it its own mistakes
+    :param data_file: a CSV file of labeled records
+    """
+    if fs.is_feature_store(data_file):
+        raise ValueError("{} is a feature store; its verifications are the classifier's own, not reviewed labels, "
+                         "so it can't be trained on".format(data_file))
+    columns = pd.read_csv(data_file, nrows=0).columns
+    if report_column in columns:
+        raise ValueError("{} is a report; its verifications are the classifier's own, not reviewed labels, "
+                         "so it can't be trained on".format(data_file))
+    if target_column not in columns:
+        raise ValueError("{} has no {} column to train on".format(data_file, target_column))
+
+
+def stream_training_data(data_files, chunksize=default_chunksize, test_size=0.2, seed=111):
+    """
+    Streams labeled records a chunk at a time, holding out a random share of them for testing. The same seed
+    holds out the same records on every pass, whatever the chunk size
+    :param data_files: the CSV files of labeled records, such as the training data
+    :param chunksize: the number of records to read at a time
+    :param test_size: the share of records to hold out
+    :param seed: the seed of the random hold-out
+    :return: generator of (feature matrix, targets, held out) per chunk, held out being a boolean array
+    """
+    for data_file in data_files:
+        check_labeled(data_file)
+
+    rng = np.random.RandomState(seed)
+    for data_file in data_files:
+        for chunk in pd.read_csv(data_file, usecols=lambda column: column in training_dtypes, dtype=training_dtypes,
+                                 chunksize=chunksize):
+            chunk = chunk[chunk[target_column].notna()]
+            held_out = rng.random_sample(len(chunk)) < test_size
+            yield prepare_features(chunk), chunk[target_column].values.astype(int), held_out
+
+
+def count_labeled_records(data_files, chunksize=default_chunksize):
+    """
+    Counts the records with a target in labeled CSV files, reading only the target column
+    """
+    for data_file in data_files:
+        check_labeled(data_file)
+    return sum(int(chunk[target_column].notna().sum())
+               for data_file in data_files
+               for chunk in pd.read_csv(data_file, usecols=[target_column], dtype=training_dtypes, chunksize=chunksize))
+
+
+def data_file_version(data_file):
+    """
+    Returns what identifies the contents of a CSV file of records: its size and when it was modified
+    """
+    return {'file': os.path.abspath(data_file), 'size': os.path.getsize(data_file),
+            'modified': os.path.getmtime(data_file)}
+
+
+def cache_training_data(data_files, cache_dir, chunksize=default_chunksize):
+    """
+    Saves the feature matrix and targets of labeled records to .npy files in cache_dir, so they are only built
+    once and can be memory-mapped by many processes at a time. They are built again when the data files change
+    :param data_files: the CSV files of labeled records
+    :param cache_dir: the folder to save them in
+    :param chunksize: the number of records to read at a time while building them
+    :return: (feature matrix, targets), memory-mapped read-only
+    """
+    features_file = os.path.join(cache_dir, "features.npy")
+    targets_file = os.path.join(cache_dir, "targets.npy")
+    manifest_file = os.path.join(cache_dir, "manifest.json")
+    manifest = {'features': vm.model_features, 'data_files': [data_file_version(data_file) for data_file in data_files]}
+
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            if json.load(f) == manifest:
+                return np.load(features_file, mmap_mode='r'), np.load(targets_file, mmap_mode='r')
+
+    # The manifest is written last, so files left half-built are built again next time
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+
+    records = count_labeled_records(data_files, chunksize)
+    features = np.lib.format.open_memmap(features_file, mode='w+', dtype=np.float64,
+                                         shape=(records, len(vm.model_features)))
+    targets = np.lib.format.open_memmap(targets_file, mode='w+', dtype=np.uint8, shape=(records,))
+    position = 0
+    for feature_matrix, chunk_targets, _ in stream_training_data(data_files, chunksize, test_size=0):
+        features[position:position + len(feature_matrix)] = feature_matrix
+        targets[position:position + len(feature_matrix)] = chunk_targets
+        position += len(feature_matrix)
+    features.flush()
+    targets.flush()
+    del features, targets
+
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return np.load(features_file, mmap_mode='r'), np.load(targets_file, mmap_mode='r')
+
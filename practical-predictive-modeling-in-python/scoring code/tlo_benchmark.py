@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+tlo_benchmark.py
+Created on 10/18/2026
+
+Times each stage of the TLO analysis on synthetic TLO files of different sizes and compares the times
+with a saved baseline, so slowdowns show up before a release rather than in production.
+
+Generate a synthetic TLO file:
+    python tlo_benchmark.py generate 100000 tlo_100k.csv
+
+Time the stages and save the times as the baseline:
+    python tlo_benchmark.py run --rows 1000 10000 100000 --save-baseline benchmarks/baseline.json
+
+Time them again and compare with the baseline (exits with 1 if a stage got slower):
+    python tlo_benchmark.py run --rows 1000 10000 100000 --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import bin.synthetic_tlo_data as synthetic
+import bin.tlo_name_checks as nc
+import tlo_checker as tlo
+
+# The stages of the TLO analysis, in the order they run
+stages = ['read', 'clean', 'normalize', 'name_checks', 'fuzzy_features', 'scoring', 'model', 'write']
+
+# A stage has regressed when it takes this much longer than in the baseline...
+default_tolerance = 0.20
+
+# ...and at least this many seconds longer, so stages that take next to no time don't flag on noise
+min_regression_seconds = 0.05
+
+mb = 1024.0 * 1024.0
+
+
+def data_file(data_dir, rows, seed):
+    """
+    Returns the synthetic TLO file with the given number of rows, generating it if it doesn't exist yet
+    """
+    file_name = os.path.join(data_dir, "synthetic_tlo_{}_{}.csv".format(rows, seed))
+    if not os.path.exists(file_name):
+        print("{} - Generating {} synthetic TLO records".format(datetime.now(), rows))
+        synthetic.write_tlo_file(file_name, rows, seed)
+    return file_name
+
+
+def frame_memory(df):
+    """
+    Returns the memory the analyzed data frame takes, in MB, in total and by dtype (see DataFrame.memory_usage)
+    """
+    usage = df.memory_usage(deep=True)
+    by_dtype = usage.drop('Index').groupby(df.dtypes.astype(str)).sum()
+    return {'total': round(usage.sum() / mb, 2), 'by_dtype': {dtype: round(size / mb, 2) for dtype, size in by_dtype.items()}}
+
+
+def time_stages(file_name, report_file):
+    """
+    Runs the TLO analysis on a file, one stage at a time
+    :return: dict of stage: seconds, and the memory the analyzed data frame takes (see frame_memory)
+    """
+    timings = {}
+
+    def timed(stage, step, *args):
+        started = time.perf_counter()
+        result = step(*args)
+        timings[stage] = time.perf_counter() - started
+        return result
+
+    df = timed('read', tlo.read_tlo_file, file_name)
+    timed('clean', tlo.clean_tlo_data, df)
+    timed('normalize', tlo.normalize_tlo_data, df)
+    timed('name_checks', tlo.run_name_checks, df)
+    timed('fuzzy_features', tlo.create_tlo_features, df)
+    timed('scoring', tlo.create_tlo_scores, df)
+    timed('model', tlo.verify_tlo_records, df)
+    df['sent_to_tlo_on'] = tlo.get_tlo_send_date()
+    timed('write', lambda: df.to_csv(report_file, sep=',', encoding='utf-8'))
+
+    return timings, frame_memory(df)
+
+
+def benchmark_name_checks(file_name, repeat=3):
+    """
+    Times the name checks run row by row with DataFrame.apply, the way tlo_checker used to, against the bulk
+    name checks, on the same prepared data, and checks they agree
+    :return: dict with the fastest time of each and whether they gave the same results
+    """
+    tlo.init_worker()
+    df = tlo.read_tlo_file(file_name)
+    tlo.clean_tlo_data(df)
+    tlo.normalize_tlo_data(df)
+    parts = ['tlo_first_name_1', 'tlo_middle_name_1', 'tlo_last_name_1',
+             'tlo_first_name_2', 'tlo_middle_name_2', 'tlo_last_name_2']
+
+    def by_row():
+        return (df.apply(lambda x: nc.exact_name_check(x['full_name'], [x[part] for part in parts]), axis=1).values,
+                df.apply(lambda x: nc.last_name_check(x['tlo_last_name_1'], x['tlo_last_name_2'], x['last_name']),
+                         axis=1).values)
+
+    def bulk():
+        return (nc.exact_name_checks(df['full_name'].values, *[df[part].values for part in parts]),
+                nc.last_name_checks(df['tlo_last_name_1'].values, df['tlo_last_name_2'].values, df['last_name'].values))
+
+    timings = {}
+    results = {}
+    for name, checks in [('apply', by_row), ('bulk', bulk)]:
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results[name] = checks()
+            runs.append(time.perf_counter() - started)
+        timings[name] = min(runs)
+
+    return {
+        'rows': len(df),
+        'apply_seconds': timings['apply'],
+        'bulk_seconds': timings['bulk'],
+        'speedup': timings['apply'] / timings['bulk'] if timings['bulk'] else None,
+        'identical': all((apply_checks == bulk_checks).all()
+                         for apply_checks, bulk_checks in zip(results['apply'], results['bulk'])),
+    }
+
+
+def run_benchmark(sizes, seed=1, repeat=1, data_dir=None):
+    """
+    Times the stages of the TLO analysis on synthetic files of each size, keeping the fastest of the repeats
+    :param sizes: the numbers of rows to benchmark
+    :param seed: the random seed of the synthetic files
+    :param repeat: the number of times to run each size
+    :param data_dir: where to keep the synthetic files; they are generated in a temporary directory when None
+    :return: the benchmark results
+    """
+    # Load the suffix table and the classifier up front so they aren't timed as part of a stage
+    tlo.init_worker()
+
+    results = {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'seed': seed,
+        'sizes': {},
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for rows in sizes:
+            file_name = data_file(data_dir or work_dir, rows, seed)
+
+            runs = []
+            for i in range(repeat):
+                print("{} - Timing {} rows (run {} of {})".format(datetime.now(), rows, i + 1, repeat))
+                timings, memory = time_stages(file_name, os.path.join(work_dir, "report.csv"))
+                runs.append(timings)
+
+            timings = {stage: min(run[stage] for run in runs) for stage in stages}
+            total = sum(timings.values())
+            results['sizes'][str(rows)] = {
+                'stages': timings,
+                'total': total,
+                'rows_per_sec': rows / total if total else 0,
+                'frame_memory_mb': memory,
+            }
+
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=default_tolerance):
+    """
+    Compares the stage times of a benchmark with those of the baseline
+    :return: list of (rows, stage, baseline seconds, seconds) for the stages that regressed
+    """
+    regressions = []
+    for rows, size in results['sizes'].items():
+        if rows not in baseline['sizes']:
+            continue
+        for stage, seconds in size['stages'].items():
+            was = baseline['sizes'][rows]['stages'].get(stage)
+            if was is not None and seconds > was * (1 + tolerance) and seconds - was > min_regression_seconds:
+                regressions.append((rows, stage, was, seconds))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    for rows, size in results['sizes'].items():
+        print("\n{} rows: {:.2f}s ({:.0f} rows/sec)".format(rows, size['total'], size['rows_per_sec']))
+        was = baseline['sizes'].get(rows) if baseline else None
+        for stage in stages:
+            line = "  {:<16}{:>9.3f}s".format(stage, size['stages'][stage])
+            if was and stage in was['stages'] and was['stages'][stage]:
+                line += "  {:>+7.1%} vs baseline".format(size['stages'][stage] / was['stages'][stage] - 1)
+            print(line)
+        if 'frame_memory_mb' in size:
+            memory = size['frame_memory_mb']
+            line = "  {:<16}{:>9.1f}MB".format('frame memory', memory['total'])
+            if was and 'frame_memory_mb' in was:
+                line += " {:>+7.1%} vs baseline".format(memory['total'] / was['frame_memory_mb']['total'] - 1)
+            print(line)
+            for dtype, size_mb in sorted(memory['by_dtype'].items(), key=lambda item: -item[1]):
+                print("    {:<14}{:>9.1f}MB".format(dtype, size_mb))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the TLO analysis on synthetic data")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    generate = commands.add_parser("generate", help="write a synthetic TLO file")
+    generate.add_argument("rows", type=int, help="the number of records")
+    generate.add_argument("file", help="the file to write")
+    generate.add_argument("--seed", type=int, default=1, help="the random seed")
+
+    run = commands.add_parser("run", help="time the stages of the TLO analysis")
+    run.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000],
+                     help="the sizes of the synthetic files to time, in rows (1k to 5M)")
+    run.add_argument("--seed", type=int, default=1, help="the random seed of the synthetic files")
+    run.add_argument("--repeat", type=int, default=1, help="time each size this many times and keep the fastest")
+    run.add_argument("--data-dir", default=None, help="keep the synthetic files here and reuse them between runs")
+    run.add_argument("--baseline", default=None, help="baseline JSON to compare the times with")
+    run.add_argument("--save-baseline", default=None, help="save the times as the baseline JSON")
+    run.add_argument("--tolerance", type=float, default=default_tolerance,
+                     help="how much slower than the baseline a stage may get before it's a regression")
+    name_checks = commands.add_parser("name-checks",
+                                      help="compare the row by row (apply) and bulk name checks")
+    name_checks.add_argument("--rows", type=int, default=100000, help="the size of the synthetic file")
+    name_checks.add_argument("--seed", type=int, default=1, help="the random seed of the synthetic file")
+    name_checks.add_argument("--repeat", type=int, default=3, help="time each this many times and keep the fastest")
+    name_checks.add_argument("--data-dir", default=None, help="keep the synthetic file here and reuse it")
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        synthetic.write_tlo_file(args.file, args.rows, args.seed)
+        return
+
+    if args.command == "name-checks":
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = benchmark_name_checks(data_file(args.data_dir or work_dir, args.rows, args.seed), args.repeat)
+        print("{rows} rows: apply {apply_seconds:.3f}s, bulk {bulk_seconds:.3f}s ({speedup:.1f}x), "
+              "identical: {identical}".format(**results))
+        if not results['identical']:
+            sys.exit(1)
+        return
+
+    results = run_benchmark(args.rows, seed=args.seed, repeat=args.repeat, data_dir=args.data_dir)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("\n{} - Saved the baseline to {}".format(datetime.now(), args.save_baseline))
+
+    if baseline:
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for rows, stage, was, seconds in regressions:
+            print("REGRESSION: {} at {} rows took {:.3f}s, {:.3f}s in the baseline".format(stage, rows, seconds, was))
+        if regressions:
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
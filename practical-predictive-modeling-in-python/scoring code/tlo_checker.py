@@ -9,32 +9,27 @@ Copyright (c) 2015 Robert Dempsey. All rights reserved.
 
 import pandas as pd
 import numpy as np
-import pickle
-import string
-import csv
 from time import strftime
 from datetime import datetime
 import configparser
+import argparse
+import collections
 import os
 import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
 import bin.cleaners as clean
+import bin.duplicate_claimants as dc
+import bin.feature_graph as fg
+import bin.feature_store as fs
 import bin.normalizers as norm
+import bin.report_writers as rw
+import bin.score_cache as sc
+import bin.stage_metrics as sm
 import bin.tlo_name_checks as nc
 import bin.tlo_verification_and_matching as vm
 import sys
 
-# Globals we need to work with
-exclude = set(string.punctuation)
-
-# suffixes will be a dict of all the suffixes that may be part of a last name
-suffixes = {}
-for i, line in enumerate(csv.reader(open("./utils/suffixes.csv"))):
-    if i==0:
-        headers = line
-        continue
-    if line[1]:
-        suffixes[line[0]] = line[1]
-
 ##
 # HELPER FUNCTIONS
 ##
@@ -48,55 +43,129 @@ def get_tlo_send_date():
     return strftime("%Y-%m-%d %H:%M:%S")
 
 ##
-# Report Generation
+# Dtypes
 ##
 
-def process_tlo_file(file_to_process, type_of_file):
-
-
-    ##
-    # Run the awesome
-    ##
-
-    print("{} - Preparing to run the TLO analysis".format(datetime.now()))
-
-    # Read the config file and get the goodies
-    config = configparser.ConfigParser()
-    config.read('config/config.ini')
-    base_path = config['TLO']['tlo_file_path']
-
-
-    ##
-    # Get the file information
-    ##
+# The columns of a TLO file and the dtypes to read them as. Everything else is read as text too, so a file reads
+# the same whether it's read whole or in chunks (and SSNs and claim numbers keep their leading zeros)
+tlo_file_dtypes = collections.defaultdict(lambda: str, {
+    'Type': 'category',
+    'claim_number': str, 'last_name': str, 'first_name': str, 'date_of_birth': str, 'ssn': str,
+    'TloName1FirstName': str, 'TloName1MiddleName': str, 'TloName1LastName': str,
+    'TloName2FirstName': str, 'TloName2MiddleName': str, 'TloName2LastName': str,
+    'TloSSN': str, 'TloDateOfBirth': str,
+})
 
-    file_to_analyze = file_to_process
-    report_type = type_of_file
-
-
-    # Set up the paths, directories and file names we'll use
-    report_file_name = "tlo_check_{}_{}_check_scores.csv".format(strftime("%m_%d_%y"), report_type)
-    report_path = base_path + "TLO Checks {}".format(strftime("%m.%d.%y"))
-    report_file = report_path +  "/" + report_file_name
+# The few values of the failure explanation and of the review, as categoricals with fixed categories so chunks
+# and the parts analyzed by worker processes put back together without losing the dtype
+failure_explanation_dtype = pd.CategoricalDtype(vm.failure_explanations)
+review_dtype = pd.CategoricalDtype(['', 'VISUAL'])
 
 
-    # Make the new directory
-    if not os.path.exists(report_path):
-      os.mkdir(report_path)
-
+def add_ratios(*ratios):
+    """
+    Adds up fuzzy ratios (0 to 100 each) into a score, as uint16 so the sum doesn't overflow the uint8 ratios
+    """
+    return fg.add_columns(*[np.asarray(ratio, dtype=np.uint16) for ratio in ratios])
 
-    print("{} - Retrieving the report data".format(datetime.now()))
+##
+# Features
+##
 
-    # Read the data
-    df = pd.read_csv(file_to_analyze)
+# The TLO name combinations each full name is checked against, and the names they are made of
+tlo_name_combos = {
+    'tlo_name_combo_1': ['tlo_first_name_1', 'tlo_middle_name_1'],
+    'tlo_name_combo_2': ['tlo_first_name_1', 'tlo_last_name_1'],
+    'tlo_name_combo_3': ['tlo_first_name_1', 'tlo_middle_name_2'],
+    'tlo_name_combo_4': ['tlo_first_name_1', 'tlo_last_name_2'],
+    'tlo_name_combo_5': ['tlo_first_name_2', 'tlo_middle_name_1'],
+    'tlo_name_combo_6': ['tlo_first_name_2', 'tlo_last_name_1'],
+    'tlo_name_combo_7': ['tlo_first_name_2', 'tlo_middle_name_2'],
+    'tlo_name_combo_8': ['tlo_first_name_2', 'tlo_last_name_2'],
+    'tlo_name_combo_9': ['tlo_first_name_1', 'tlo_middle_name_1', 'tlo_last_name_1'],
+    'tlo_name_combo_10': ['tlo_first_name_2', 'tlo_middle_name_2', 'tlo_last_name_2'],
+    'tlo_name_combo_11': ['tlo_first_name_1', 'tlo_last_name_1', 'tlo_last_name_2'],
+    'tlo_name_combo_12': ['tlo_first_name_1', 'tlo_last_name_2', 'tlo_last_name_1'],
+    'tlo_name_combo_13': ['tlo_first_name_2', 'tlo_last_name_1', 'tlo_last_name_2'],
+    'tlo_name_combo_14': ['tlo_first_name_2', 'tlo_last_name_2', 'tlo_last_name_1'],
+}
+
+ssn_feature_columns = ['ssn_{}'.format(scorer) for scorer in nc.fuzzy_scorers]
+dob_feature_columns = ['dob_{}'.format(scorer) for scorer in nc.fuzzy_scorers]
+
+# The features, in report order. The name combinations are never stored: they are built when the name features
+# need them, and only for the records that didn't pass the full name check (the rest score 0)
+tlo_features = [fg.Feature(combo, parts, fg.add_columns, stored=False) for combo, parts in tlo_name_combos.items()] + [
+    fg.Feature(ssn_feature_columns, ['ssn', 'tlo_ssn'], nc.fuzzy_feature_matrix),
+    fg.Feature(dob_feature_columns, ['date_of_birth', 'tlo_dob'], nc.fuzzy_feature_matrix),
+    fg.Feature(nc.name_feature_columns,
+               ['full_name'] + list(tlo_name_combos),
+               lambda full_names, *combos: nc.name_feature_matrix(full_names, combos),
+               when=('full_name_check_value', 0)),
+]
+
+# The scores, each the sum of its features
+tlo_scores = [fg.Feature('ssn_score', ssn_feature_columns, add_ratios),
+              fg.Feature('dob_score', dob_feature_columns, add_ratios)] + \
+             [fg.Feature('n{}_score'.format(k), nc.name_feature_columns[3 * (k - 1):3 * k], add_ratios)
+              for k in range(1, 15)]
+
+# The dtype of each column the analysis adds: 0 to 100 ratios as uint8, 0 to 300 scores as uint16, the 0/1 name
+# checks as the int8 the bulk name checks return, matches and verifications as uint8 (so reports still say 0 and 1)
+# and categoricals for the explanation and review
+scored_dtypes = dict([(column, np.uint8) for column in ssn_feature_columns + dob_feature_columns + nc.name_feature_columns] +
+                     [(feature.name, np.uint16) for feature in tlo_scores] +
+                     [(column, np.int8) for column in ['full_name_check_value', 'last_name_check_value']] +
+                     [(column, np.uint8) for column in ['ssn_match', 'dob_match', 'name_match',
+                                                        'failure_explanation_numeric', 'verified']] +
+                     [('failure_explanation', failure_explanation_dtype), ('review', review_dtype)])
+
+# The columns the analysis adds, in the order it adds them (and the report has them)
+scored_columns = ['full_name_check_value', 'last_name_check_value'] + ssn_feature_columns + dob_feature_columns + \
+                 nc.name_feature_columns + [feature.name for feature in tlo_scores] + \
+                 ['ssn_match', 'dob_match', 'name_match', 'failure_explanation', 'failure_explanation_numeric',
+                  'verified', 'review']
+
+# The columns saved to the feature store (see process_tlo_file): the keys of the records and every number the
+# analysis adds
+feature_store_columns = dict([('claim_number', fs.claim_number_dtype), ('sent_to_tlo_on', fs.sent_to_tlo_on_dtype)] +
+                             [(column, dtype) for column, dtype in scored_dtypes.items()
+                              if not isinstance(dtype, pd.CategoricalDtype)])
+
+# The stages of a run that are timed, and can be profiled
+tlo_stages = ['read', 'clean', 'normalize', 'name_checks', 'fuzzy_features', 'scoring', 'model', 'workers', 'duplicates',
+              'write', 'feature_store']
+
+# The source of the code that computes the scores; the score cache is emptied when any of it changes
+scoring_code_files = [os.path.abspath(__file__), clean.__file__, fg.__file__, norm.__file__, nc.__file__, vm.__file__]
+
+# The normalized claimant and TLO fields that decide a record's scores, used to key the score cache
+cache_key_columns = ['first_name', 'last_name', 'ssn', 'date_of_birth',
+                     'tlo_first_name_1', 'tlo_middle_name_1', 'tlo_last_name_1',
+                     'tlo_first_name_2', 'tlo_middle_name_2', 'tlo_last_name_2',
+                     'tlo_ssn', 'tlo_dob']
 
+##
+# Report Generation
+##
 
-    ##
-    # Preprocessing
-    ##
+def read_tlo_file(file_to_analyze, chunksize=None):
+    """
+    Reads a TLO file, with the dtypes in tlo_file_dtypes
+    :param file_to_analyze: the TLO file
+    :param chunksize: if given, the number of rows to read at a time
+    :return: a data frame, or an iterator of data frames when reading in chunks
+    """
+    return pd.read_csv(file_to_analyze, dtype=tlo_file_dtypes, chunksize=chunksize)
 
-    print("{} - Cleaning up the data".format(datetime.now()))
 
+def clean_tlo_data(df):
+    """
+    Copies the fields of a TLO file to the names used in the analysis, fills in missing TLO data and
+    cleans up the names
+    :param df: data frame of TLO data
+    :return: the data frame, cleaned up
+    """
     # keep these for reference
     # Fields: sent_to_tlo_on,type,unique_claimant_id,last_name,first_name,date_of_birth,ssn,tlo_first_name_1,tlo_middle_name_1,tlo_last_name_1,tlo_first_name_2,tlo_middle_name_2,tlo_last_name_2,tlo_ssn,tlo_dob
     df['co_type'] = df.Type
@@ -114,44 +183,31 @@ def process_tlo_file(file_to_process, type_of_file):
     df['tlo_ssn'] = df.TloSSN
     df['tlo_dob'] = df.TloDateOfBirth
 
-    # Fill in missing data, use "inplace=TRUE" to ensure the data frame contents are changed
-    df.tlo_first_name_1.fillna('Missing', inplace=True)
-    df.tlo_middle_name_1.fillna('Missing', inplace=True)
-    df.tlo_last_name_1.fillna('Missing', inplace=True)
-    df.tlo_first_name_2.fillna('Missing', inplace=True)
-    df.tlo_middle_name_2.fillna('Missing', inplace=True)
-    df.tlo_last_name_2.fillna('Missing', inplace=True)
-    df.tlo_ssn.fillna('Missing', inplace=True)
-    df.tlo_dob.fillna('Missing', inplace=True)
+    # Fill in missing data
+    tlo_columns = ['tlo_first_name_1', 'tlo_middle_name_1', 'tlo_last_name_1',
+                   'tlo_first_name_2', 'tlo_middle_name_2', 'tlo_last_name_2',
+                   'tlo_ssn', 'tlo_dob']
+    df[tlo_columns] = df[tlo_columns].fillna('Missing')
 
     ##
     # Clean it all up
     ###
 
-    # Remove internal abbreviations
-    df.last_name = df.last_name.apply(clean.remove_internal_abbreviations)
-
-    # Remove the punctuation
-    df.first_name = df.first_name.apply(clean.remove_punctuation)
-    df.last_name = df.last_name.apply(clean.remove_punctuation)
-    df.tlo_first_name_1 = df.tlo_first_name_1.apply(clean.remove_punctuation)
-    df.tlo_last_name_1 = df.tlo_last_name_1.apply(clean.remove_punctuation)
-    df.tlo_first_name_2 = df.tlo_first_name_2.apply(clean.remove_punctuation)
-    df.tlo_last_name_2 = df.tlo_last_name_2.apply(clean.remove_punctuation)
-
-    # Remove suffixes from last names
-    df.last_name = df.last_name.apply(clean.remove_suffixes)
-    df.tlo_last_name_1 = df.tlo_last_name_1.apply(clean.remove_suffixes)
-    df.tlo_last_name_2 = df.tlo_last_name_2.apply(clean.remove_suffixes)
-
-    # Remove whitespace
-    df.first_name = df.first_name.apply(clean.remove_whitespace)
-    df.last_name = df.last_name.apply(clean.remove_whitespace)
-    df.tlo_first_name_1 = df.tlo_first_name_1.apply(clean.remove_whitespace)
-    df.tlo_last_name_1 = df.tlo_last_name_1.apply(clean.remove_whitespace)
-    df.tlo_first_name_2 = df.tlo_first_name_2.apply(clean.remove_whitespace)
-    df.tlo_last_name_2 = df.tlo_last_name_2.apply(clean.remove_whitespace)
+    # Remove internal abbreviations, punctuation, suffixes and whitespace
+    suffix_matcher = clean.get_suffix_matcher()
+    clean.clean_frame(df, ['last_name'], abbreviations=True, suffix_matcher=suffix_matcher)
+    clean.clean_frame(df, ['tlo_last_name_1', 'tlo_last_name_2'], suffix_matcher=suffix_matcher)
+    clean.clean_frame(df, ['first_name', 'tlo_first_name_1', 'tlo_first_name_2'])
 
+    return df
+
+
+def normalize_tlo_data(df):
+    """
+    Normalizes the names, SSNs and DOBs of cleaned up TLO data and creates the full names to compare
+    :param df: data frame of TLO data, as cleaned up by clean_tlo_data
+    :return: the data frame, normalized
+    """
     # Normalize the names
     df.first_name = df.first_name.apply(norm.normalize_name)
     df.last_name = df.last_name.apply(norm.normalize_name)
@@ -161,260 +217,540 @@ def process_tlo_file(file_to_process, type_of_file):
     df.tlo_ssn = df.tlo_ssn.apply(norm.normalize_ssn)
 
     # Normalize the DOB
-    df.date_of_birth = df.date_of_birth.apply(norm.normalize_dob)
-    df.tlo_dob = df.tlo_dob.apply(norm.normalize_dob)
+    df.date_of_birth = norm.normalize_dob_series(df.date_of_birth)
+    df.tlo_dob = norm.normalize_dob_series(df.tlo_dob)
 
 
     # Create full names for comparison
     df['full_name'] = df.first_name + df.last_name
 
-    df['tlo_name_combo_1'] = df.tlo_first_name_1 + df.tlo_middle_name_1
-    df['tlo_name_combo_2'] = df.tlo_first_name_1 + df.tlo_last_name_1
-    df['tlo_name_combo_3'] = df.tlo_first_name_1 + df.tlo_middle_name_2
-    df['tlo_name_combo_4'] = df.tlo_first_name_1 + df.tlo_last_name_2
-    df['tlo_name_combo_5'] = df.tlo_first_name_2 + df.tlo_middle_name_1
-    df['tlo_name_combo_6'] = df.tlo_first_name_2 + df.tlo_last_name_1
-    df['tlo_name_combo_7'] = df.tlo_first_name_2 + df.tlo_middle_name_2
-    df['tlo_name_combo_8'] = df.tlo_first_name_2 + df.tlo_last_name_2
-    df['tlo_name_combo_9'] = df.tlo_first_name_1 + df.tlo_middle_name_1 + df.tlo_last_name_1
-    df['tlo_name_combo_10'] = df.tlo_first_name_2 + df.tlo_middle_name_2 + df.tlo_last_name_2
-    df['tlo_name_combo_11'] = df.tlo_first_name_1 + df.tlo_last_name_1 + df.tlo_last_name_2
-    df['tlo_name_combo_12'] = df.tlo_first_name_1 + df.tlo_last_name_2 + df.tlo_last_name_1
-    df['tlo_name_combo_13'] = df.tlo_first_name_2 + df.tlo_last_name_1 + df.tlo_last_name_2
-    df['tlo_name_combo_14'] = df.tlo_first_name_2 + df.tlo_last_name_2 + df.tlo_last_name_1
+    return df
+
+
+def prepare_tlo_data(df, verbose=True, metrics=None):
+    """
+    Cleans up and normalizes the data read from a TLO file
+    :param df: data frame of TLO data
+    :param verbose: print the progress of each step
+    :param metrics: the StageMetrics to record the steps in, if any
+    :return: the data frame, prepared for scoring
+    """
 
     ##
-    # Run name check by removal
+    # Preprocessing
     ##
 
-    print("{} - Running name checks".format(datetime.now()))
+    if verbose:
+        print("{} - Cleaning up the data".format(datetime.now()))
+
+    with sm.stage(metrics, 'clean', len(df)):
+        clean_tlo_data(df)
+
+    with sm.stage(metrics, 'normalize', len(df)):
+        normalize_tlo_data(df)
+
+    return df
 
+
+def run_name_checks(df):
+    """
+    Runs the exact name check and the last name check on prepared TLO data
+    :param df: data frame of TLO data, as prepared by prepare_tlo_data
+    :return: the data frame, with the name checks added
+    """
     # Name check ala Bob Flanders
-    df['full_name_check_value'] = df.apply(lambda x: nc.exact_name_check(x['full_name'], [
-                                                                                        x['tlo_first_name_1'], 
-                                                                                        x['tlo_middle_name_1'], 
-                                                                                        x['tlo_last_name_1'], 
-                                                                                        x['tlo_first_name_2'], 
-                                                                                        x['tlo_middle_name_2'], 
-                                                                                        x['tlo_last_name_2']
-                                                                                    ]), axis=1)
+    df['full_name_check_value'] = nc.exact_name_checks(df['full_name'].values,
+                                                       df['tlo_first_name_1'].values,
+                                                       df['tlo_middle_name_1'].values,
+                                                       df['tlo_last_name_1'].values,
+                                                       df['tlo_first_name_2'].values,
+                                                       df['tlo_middle_name_2'].values,
+                                                       df['tlo_last_name_2'].values)
 
     # Last name check
-    df['last_name_check_value'] = df.apply(lambda x: nc.last_name_check(x['tlo_last_name_1'], x['tlo_last_name_2'], x['last_name']), axis=1)
+    df['last_name_check_value'] = nc.last_name_checks(df['tlo_last_name_1'].values,
+                                                      df['tlo_last_name_2'].values,
+                                                      df['last_name'].values)
+
+    return df
+
+
+def create_tlo_features(df):
+    """
+    Creates the SSN, DOB and name features of TLO data that has been through the name checks
+    """
+    return fg.evaluate(df, tlo_features)
+
+
+def create_tlo_scores(df):
+    """
+    Creates the scores from the features and decides whether the SSN, DOB and name of each record match
+    :param df: data frame of TLO data, with the features added by create_tlo_features
+    :return: the data frame, with the scores and matches added
+    """
+    fg.evaluate(df, tlo_scores)
+
+    # The name scores as a matrix, one row per record
+    name_scores = df[vm.name_score_columns].values
+
+    # Determine if there is an SSN match
+    df['ssn_match'] = vm.ssn_matches(df['ssn_score'].values)
+
+    # Determine if there is a DOB match
+    df['dob_match'] = vm.dob_matches(df['dob_score'].values)
+
+    # Determine if there is a name match
+    df['name_match'] = vm.name_matches(df['full_name_check_value'].values,
+                                       df['last_name_check_value'].values,
+                                       name_scores)
+
+    # List the failure explanation - this is used to apply deficiencies in CO. The categories of the explanations
+    # are indexed by the same codes
+    failure_codes = vm.failure_codes(df['ssn_match'].values,
+                                     df['dob_match'].values,
+                                     df['name_match'].values)
+    df['failure_explanation'] = pd.Categorical.from_codes(failure_codes, dtype=failure_explanation_dtype)
+
+    # Convert the failure explanation to a numeric
+    df['failure_explanation_numeric'] = vm.convert_failure_codes_to_numbers(failure_codes)
+
+    return df
+
+
+def verify_tlo_records(df, cascade_rules=None):
+    """
+    Verifies scored TLO records with the classifier and decides which need a review
+    :param df: data frame of TLO data, with the scores added by create_tlo_scores
+    :param cascade_rules: if given, verify the records the cascade rules decide by rule and only the rest with
+                          the classifier (see vm.load_cascade_rules)
+    :return: the data frame, with the verifications and reviews added
+    """
+    # Verify the records, all at once
+    if cascade_rules is None:
+        df['verified'] = vm.verify_records(df[vm.model_features].values)
+    else:
+        df['verified'] = vm.verify_records_cascade(df[vm.model_features].values, cascade_rules)
+
+    # Determine if a review is needed on a record
+    df['review'] = pd.Categorical(vm.determine_review_types(df['full_name_check_value'].values,
+                                                            df['verified'].values,
+                                                            df[vm.name_score_columns].values),
+                                  dtype=review_dtype)
+
+    return df
+
+
+def score_tlo_data(df, verbose=True, metrics=None, cascade_rules=None):
+    """
+    Runs the name checks, creates the features and scores and verifies the records of prepared TLO data
+    :param df: data frame of TLO data, as prepared by prepare_tlo_data
+    :param verbose: print the progress of each step
+    :param metrics: the StageMetrics to record the steps in, if any
+    :param cascade_rules: if given, the cascade rules to verify records by before using the classifier
+    :return: the data frame, with the scores added
+    """
+
+    ##
+    # Run name check by removal
+    ##
+
+    if verbose:
+        print("{} - Running name checks".format(datetime.now()))
+
+    with sm.stage(metrics, 'name_checks', len(df)):
+        run_name_checks(df)
 
 
     ##
     # Features
     ##
 
-    print("{} - Creating required features".format(datetime.now()))
-
-    # SSN features
-    df['ssn_ratio'] = df.apply(lambda x: nc.fuzzy_ratio(x['ssn'], x['tlo_ssn']), axis=1)
-    df['ssn_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio(x['ssn'], x['tlo_ssn']), axis=1)
-    df['ssn_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio(x['ssn'], x['tlo_ssn']), axis=1)
-
-    # DOB features
-    df['dob_ratio'] = df.apply(lambda x: nc.fuzzy_ratio(x['date_of_birth'], x['tlo_dob']), axis=1)
-    df['dob_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio(x['date_of_birth'], x['tlo_dob']), axis=1)
-    df['dob_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio(x['date_of_birth'], x['tlo_dob']), axis=1)
-
-    # Name 1 features
-    df['name_1_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_1']), axis=1)
-    df['name_1_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_1']), axis=1)
-    df['name_1_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_1']), axis=1)
-
-    # Name 2 features
-    df['name_2_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_2']), axis=1)
-    df['name_2_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_2']), axis=1)
-    df['name_2_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_2']), axis=1)
-
-    # Name 3 features
-    df['name_3_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_3']), axis=1)
-    df['name_3_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_3']), axis=1)
-    df['name_3_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_3']), axis=1)
-
-    # Name 4 features
-    df['name_4_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_4']), axis=1)
-    df['name_4_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_4']), axis=1)
-    df['name_4_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_4']), axis=1)
-
-    # Name 5 features
-    df['name_5_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_5']), axis=1)
-    df['name_5_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_5']), axis=1)
-    df['name_5_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_5']), axis=1)
-
-    # Name 6 features
-    df['name_6_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_6']), axis=1)
-    df['name_6_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_6']), axis=1)
-    df['name_6_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_6']), axis=1)
-
-    # Name 7 features
-    df['name_7_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_7']), axis=1)
-    df['name_7_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_7']), axis=1)
-    df['name_7_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_7']), axis=1)
-
-    # Name 8 features
-    df['name_8_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_8']), axis=1)
-    df['name_8_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_8']), axis=1)
-    df['name_8_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_8']), axis=1)
-
-    # Name 9 features
-    df['name_9_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_9']), axis=1)
-    df['name_9_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_9']), axis=1)
-    df['name_9_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_9']), axis=1)
-
-    # Name 10 features
-    df['name_10_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_10']), axis=1)
-    df['name_10_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_10']), axis=1)
-    df['name_10_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_10']), axis=1)
-
-    # Name 11 features
-    df['name_11_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_11']), axis=1)
-    df['name_11_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_11']), axis=1)
-    df['name_11_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_11']), axis=1)
-
-    # Name 12 features
-    df['name_12_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_12']), axis=1)
-    df['name_12_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_12']), axis=1)
-    df['name_12_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_12']), axis=1)
-
-    # Name 13 features
-    df['name_13_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_13']), axis=1)
-    df['name_13_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_13']), axis=1)
-    df['name_13_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_13']), axis=1)
-
-    # Name 14 features
-    df['name_14_ratio'] = df.apply(lambda x: nc.fuzzy_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_14']), axis=1)
-    df['name_14_token_sort_ratio'] = df.apply(lambda x: nc.fuzzy_token_sort_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_14']), axis=1)
-    df['name_14_partial_ratio'] = df.apply(lambda x: nc.fuzzy_partial_ratio_check(x['full_name_check_value'], x['full_name'], x['tlo_name_combo_14']), axis=1)
+    if verbose:
+        print("{} - Creating required features".format(datetime.now()))
+
+    # SSN, DOB and name features
+    with sm.stage(metrics, 'fuzzy_features', len(df)):
+        create_tlo_features(df)
 
 
     ##
     # Scoring
     ##
 
-    print("{} - Creating the scores".format(datetime.now()))
-
-    df['ssn_score'] = df['ssn_ratio'] + df['ssn_token_sort_ratio'] + df['ssn_partial_ratio']
-    df['dob_score'] = df['dob_ratio'] + df['dob_token_sort_ratio'] + df['dob_partial_ratio']
-
-    df['n1_score'] = df['name_1_ratio'] + df['name_1_token_sort_ratio'] + df['name_1_partial_ratio']
-    df['n2_score'] = df['name_2_ratio'] + df['name_2_token_sort_ratio'] + df['name_2_partial_ratio']
-    df['n3_score'] = df['name_3_ratio'] + df['name_3_token_sort_ratio'] + df['name_3_partial_ratio']
-    df['n4_score'] = df['name_4_ratio'] + df['name_4_token_sort_ratio'] + df['name_4_partial_ratio']
-    df['n5_score'] = df['name_5_ratio'] + df['name_5_token_sort_ratio'] + df['name_5_partial_ratio']
-    df['n6_score'] = df['name_6_ratio'] + df['name_6_token_sort_ratio'] + df['name_6_partial_ratio']
-    df['n7_score'] = df['name_7_ratio'] + df['name_7_token_sort_ratio'] + df['name_7_partial_ratio']
-    df['n8_score'] = df['name_8_ratio'] + df['name_8_token_sort_ratio'] + df['name_8_partial_ratio']
-    df['n9_score'] = df['name_9_ratio'] + df['name_9_token_sort_ratio'] + df['name_9_partial_ratio']
-    df['n10_score'] = df['name_10_ratio'] + df['name_10_token_sort_ratio'] + df['name_10_partial_ratio']
-    df['n11_score'] = df['name_11_ratio'] + df['name_11_token_sort_ratio'] + df['name_11_partial_ratio']
-    df['n12_score'] = df['name_12_ratio'] + df['name_12_token_sort_ratio'] + df['name_12_partial_ratio']
-    df['n13_score'] = df['name_13_ratio'] + df['name_13_token_sort_ratio'] + df['name_13_partial_ratio']
-    df['n14_score'] = df['name_14_ratio'] + df['name_14_token_sort_ratio'] + df['name_14_partial_ratio']
+    if verbose:
+        print("{} - Creating the scores".format(datetime.now()))
+
+    with sm.stage(metrics, 'scoring', len(df)):
+        create_tlo_scores(df)
 
     ##
     # Final Verification
     ##
 
-    print("{} - Analyzing the data".format(datetime.now()))
+    if verbose:
+        print("{} - Analyzing the data".format(datetime.now()))
 
-    # Determine if there is an SSN match
-    df['ssn_match'] = df.apply(lambda x: vm.ssn_match(x['ssn_score']), axis=1)
+    with sm.stage(metrics, 'model', len(df)):
+        verify_tlo_records(df, cascade_rules)
 
-    # Determine if there is a DOB match
-    df['dob_match'] = df.apply(lambda x: vm.dob_match(x['dob_score']), axis=1)
+    return df
 
-    # Determine if there is a name match
-    df['name_match'] = df.apply(lambda x: vm.name_match(x['full_name_check_value'], 
-                                                     x['last_name_check_value'],
-                                                    [
-                                                     x['n1_score'], 
-                                                     x['n2_score'],
-                                                     x['n3_score'],
-                                                     x['n4_score'],
-                                                     x['n5_score'],
-                                                     x['n6_score'],
-                                                     x['n7_score'],
-                                                     x['n8_score'],
-                                                     x['n9_score'],
-                                                     x['n10_score'],
-                                                     x['n11_score'],
-                                                     x['n12_score'],
-                                                     x['n13_score'],
-                                                     x['n14_score']
-                                                    ]), axis=1)
-
-    
-        
-    # List the failure explanation - this is used to apply deficiencies in CO
-    df['failure_explanation'] = df.apply(lambda x: vm.explain_failure(x['ssn_match'],
-                                                                      x['dob_match'],
-                                                                      x['name_match']), axis=1)
-
-    # Convert the failure explanation to a numeric
-    df['failure_explanation_numeric'] = df.apply(lambda x: vm.convert_failure_explanation_to_number(x['failure_explanation']), axis=1)
-
-    # Verify the records
-    df['verified'] = df.apply(lambda x: vm.verify_record([
-                                                          x['full_name_check_value'], 
-                                                          x['ssn_score'],
-                                                          x['dob_score'],
-                                                          x['n1_score'], 
-                                                          x['n2_score'],
-                                                          x['n3_score'],
-                                                          x['n4_score'],
-                                                          x['n5_score'],
-                                                          x['n6_score'],
-                                                          x['n7_score'],
-                                                          x['n8_score'],
-                                                          x['n9_score'],
-                                                          x['n10_score'],
-                                                          x['n11_score'],
-                                                          x['n12_score'],
-                                                          x['n13_score'],
-                                                          x['n14_score'],
-                                                          x['ssn_match'],
-                                                          x['dob_match'],
-                                                          x['name_match'],
-                                                          x['failure_explanation_numeric'],
-                                                          x['last_name_check_value']
-                                                         ]), axis=1)
 
-    # Determine if a review is needed on a record
-    df['review'] = df.apply(lambda x: vm.determine_review_type(x['full_name_check_value'], 
-                                                               x['verified'],
-                                                                [
-                                                                 x['n1_score'], 
-                                                                 x['n2_score'],
-                                                                 x['n3_score'],
-                                                                 x['n4_score'],
-                                                                 x['n5_score'],
-                                                                 x['n6_score'],
-                                                                 x['n7_score'],
-                                                                 x['n8_score'],
-                                                                 x['n9_score'],
-                                                                 x['n10_score'],
-                                                                 x['n11_score'],
-                                                                 x['n12_score'],
-                                                                 x['n13_score'],
-                                                                 x['n14_score']
-                                                                ]), axis=1)
+def analyze_tlo_data(df, sent_to_tlo_on, verbose=True, metrics=None, cascade_rules=None):
+    """
+    Runs the TLO analysis on the data read from a TLO file: cleans up the data, runs the name checks,
+    creates the features and scores and verifies the records
+    :param df: data frame of TLO data
+    :param sent_to_tlo_on: the date the records were sent to tlo on
+    :param verbose: print the progress of each step
+    :param metrics: the StageMetrics to record the steps in, if any
+    :param cascade_rules: if given, the cascade rules to verify records by before using the classifier
+    :return: the data frame, with the analysis added
+    """
+    prepare_tlo_data(df, verbose, metrics)
+    score_tlo_data(df, verbose, metrics, cascade_rules)
 
     # Create a sent to tlo on date
-    df['sent_to_tlo_on'] = df.apply(lambda x: get_tlo_send_date(), axis=1)
+    df['sent_to_tlo_on'] = sent_to_tlo_on
+
+    return df
+
+
+def compact_dtypes(df):
+    """
+    Gives the columns the analysis adds the dtypes in scored_dtypes, for records that weren't just scored,
+    such as those taken from the score cache
+    """
+    return df.astype({column: dtype for column, dtype in scored_dtypes.items() if column in df.columns})
+
+
+def score_tlo_data_with_cache(df, cache, score=score_tlo_data):
+    """
+    Scores prepared TLO data, taking the records already in the score cache from there
+    and scoring (and caching) the rest
+    :param df: data frame of TLO data, as prepared by prepare_tlo_data
+    :param cache: the score cache
+    :param score: the function that scores the records that aren't in the cache
+    :return: the data frame, with the scores added
+    """
+    if len(df) == 0:
+        return score(df)
+
+    keys = sc.record_keys(df, cache_key_columns)
+    cached = cache.lookup(keys)
+    hit = np.array([key in cached for key in keys], dtype=bool)
+
+    scored = []
+
+    if hit.any():
+        scored.append(pd.DataFrame([cached[key] for key, in_cache in zip(keys, hit) if in_cache],
+                                   index=df.index[hit], columns=cache.columns))
+
+    if not hit.all():
+        missed = score(df[~hit].copy())
+        cache.store([key for key, in_cache in zip(keys, hit) if not in_cache], missed)
+        scored.append(missed[cache.columns])
+
+    # Put the cached and newly scored records back in their original order, with the dtypes they were scored with
+    df[cache.columns] = compact_dtypes(pd.concat(scored).loc[df.index])
+
+    return df
+
+
+def init_worker():
+    """
+    Loads the suffix table and the classifier in a worker process, once, before it analyzes anything
+    """
+    clean.get_suffix_matcher()
+    vm.load_classifier()
+
+
+def run_step(step, df, *args):
+    """
+    Runs a step of the TLO analysis in a worker process, returning the worker's fuzzy dedupe and cascade stats
+    with the data
+    """
+    nc.take_dedupe_stats()
+    vm.take_cascade_stats()
+    df = step(df, *args)
+    return df, {'dedupe': nc.take_dedupe_stats(), 'cascade': vm.take_cascade_stats()}
+
+
+def run_in_parallel(step, df, pool, workers, *args):
+    """
+    Splits the data into one part per worker, runs a step of the TLO analysis on the parts in the pool of
+    worker processes and puts the results back together in their original order
+    :param step: the step to run, such as analyze_tlo_data; called with a part of the data and args
+    :param df: data frame of TLO data
+    :param pool: the pool of worker processes
+    :param workers: the number of workers in the pool
+    :return: the data frame the step returns
+    """
+    print("{} - Analyzing {} rows across {} workers".format(datetime.now(), len(df), workers))
+
+    parts = [df.iloc[rows] for rows in np.array_split(np.arange(len(df)), workers) if len(rows)]
+    results = list(pool.map(run_step, [step] * len(parts), parts, *[[arg] * len(parts) for arg in args]))
+
+    for _, stats in results:
+        for key, value in stats['dedupe'].items():
+            nc.dedupe_stats[key] += value
+        for key, value in stats['cascade'].items():
+            vm.cascade_stats[key] += value
+
+    return pd.concat([part for part, _ in results])
+
+
+def process_tlo_file(file_to_process, type_of_file, chunksize=None, workers=1, cache_file=None,
+                     cache_max_entries=1000000, cache_max_age_days=90, profile_stage=None,
+                     report_format='csv', report_columns='full', compression=None, pool=None,
+                     duplicates_index=None, index_existing_reports=False, cascade=False, feature_store=None):
+    """
+    Runs the TLO analysis on a TLO file, saves the report in today's folder and moves the file there
+    :param file_to_process: the TLO file
+    :param type_of_file: the type of report
+    :param chunksize: if given, stream the file through the analysis this many rows at a time, appending each
+                      chunk to the report, so only one chunk is ever in memory
+    :param workers: if more than 1, the number of processes to split the analysis across
+    :param cache_file: if given, the SQLite file to cache scores in across runs
+    :param cache_max_entries: the most records to keep in the score cache
+    :param cache_max_age_days: the number of days to keep records in the score cache
+    :param profile_stage: if given, the stage (see tlo_stages) to profile with cProfile; the profile is saved
+                          next to the report, along with the JSON run summary that is always saved
+    :param report_format: the format to save the report in: csv, parquet or feather
+    :param report_columns: the columns to save: full (every column of the analysis) or decision
+    :param compression: the compression of the report; the format's default when None (see report_writers)
+    :param pool: a pool of `workers` worker processes to use, such as one shared by a batch of files; one is
+                 started (and shut down) for the file when None and workers is more than 1
+    :param duplicates_index: if given, the SQLite file of the index of claimants to find duplicates in. Claimants
+                             with another claim number, in this file or any indexed before, are saved to a
+                             duplicates report next to the report
+    :param index_existing_reports: add the claimants of the reports already in the report folders to the
+                                   duplicates index first
+    :param cascade: verify the records the cascade rules (vm.cascade_rules_file) decide without the classifier
+    :param feature_store: if given, the folder of a feature store to append the keys and features of the
+                          records to (see feature_store_columns), for rescoring later. If appending fails, the
+                          error is logged, the rest of the run isn't stored and the summary records the error
+    :return: the run summary
+    """
 
     ##
-    # Save the results
+    # Run the awesome
     ##
 
-    print("{} - Saving the results".format(datetime.now()))
+    print("{} - Preparing to run the TLO analysis".format(datetime.now()))
 
+    # Read the config file and get the goodies
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    base_path = config['TLO']['tlo_file_path']
 
 
-    # Export the results to a CSV file
-    df.to_csv(report_file, sep=',', encoding='utf-8')
+    ##
+    # Get the file information
+    ##
+
+    file_to_analyze = file_to_process
+    report_type = type_of_file
+
+
+    # Set up the paths, directories and file names we'll use
+    report_name = "tlo_check_{}_{}_check_scores".format(strftime("%m_%d_%y"), report_type)
+    report_path = base_path + "TLO Checks {}".format(strftime("%m.%d.%y"))
+    report_file = report_path +  "/" + report_name + rw.report_extension(report_format, compression)
+    summary_file = report_path + "/" + report_name + "_run_summary.json"
+    profile_file = report_path + "/" + report_name + "_{}.prof".format(profile_stage)
+    duplicates_file = report_path + "/" + report_name + "_duplicates.csv"
+
+
+    # Make the new directory
+    if not os.path.exists(report_path):
+      os.mkdir(report_path)
+
+
+    # Write the report in the format, and with the columns, asked for
+    report = rw.ReportWriter(report_file, report_format, report_columns, compression)
+
+    # All of the records in a report are sent on the same date
+    sent_to_tlo_on = get_tlo_send_date()
+
+    # Split the analysis across a pool of worker processes, if asked to
+    own_pool = pool is None and workers > 1
+    if own_pool:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+
+    # Verify the records the cascade rules decide without the classifier, if asked to
+    cascade_rules = vm.load_cascade_rules() if cascade else None
+
+    # Take the scores of records we've seen before from the score cache, if asked to
+    cache = None
+    if cache_file:
+        cache = sc.ScoreCache(cache_file, cache_key_columns, scored_columns,
+                              [vm.tlo_classifier_file, clean.suffixes_file] + ([vm.cascade_rules_file] if cascade else []),
+                              sc.code_version(scoring_code_files),
+                              max_entries=cache_max_entries, max_age_days=cache_max_age_days)
+
+    # Time each stage, and profile one if asked to. The stages run in worker processes are timed as one
+    metrics = sm.StageMetrics(profile_stage)
+
+    # Find claimants sent to TLO before under another claim number, if asked to
+    duplicates = None
+    if duplicates_index:
+        duplicates = dc.DuplicateIndex(duplicates_index)
+        if index_existing_reports:
+            print("{} - Indexing the claimants of earlier reports".format(datetime.now()))
+            print("{} - Indexed {} claimants".format(datetime.now(), dc.index_reports(duplicates, base_path)))
+
+    # Save the features of the records for rescoring later, if asked to
+    store = fs.FeatureStore(feature_store, feature_store_columns) if feature_store else None
+    stored = {'rows': 0, 'error': None}
+
+    def save_features(df):
+        # The records are already in the report, so a store that fails doesn't fail the run: the rest of the
+        # run isn't stored, and the summary says so
+        if store is None or stored['error'] is not None:
+            return
+        try:
+            with metrics.stage('feature_store', len(df)):
+                stored['rows'] += store.append(df, file_to_analyze)
+        except Exception as e:
+            stored['error'] = repr(e)
+            print("{} - Couldn't save the features to {}, so the rest of the run won't be stored: {!r}".format(
+                datetime.now(), feature_store, e))
+
+    def find_duplicates(df, first):
+        if duplicates is None:
+            return
+        with metrics.stage('duplicates', len(df)):
+            found = duplicates.check(df, file_to_analyze, sent_to_tlo_on)
+            found.to_csv(duplicates_file, sep=',', encoding='utf-8', index=False,
+                         mode='w' if first else 'a', header=first)
+
+    def score(df):
+        if pool is None:
+            return score_tlo_data(df, metrics=metrics, cascade_rules=cascade_rules)
+        with metrics.stage('workers', len(df)):
+            return run_in_parallel(score_tlo_data, df, pool, workers, False, None, cascade_rules)
+
+    def analyze(df):
+        if cache is not None:
+            prepare_tlo_data(df, metrics=metrics)
+            df = score_tlo_data_with_cache(df, cache, score)
+            df['sent_to_tlo_on'] = sent_to_tlo_on
+            return df
+        if pool is None:
+            return analyze_tlo_data(df, sent_to_tlo_on, metrics=metrics, cascade_rules=cascade_rules)
+        with metrics.stage('workers', len(df)):
+            return run_in_parallel(analyze_tlo_data, df, pool, workers, sent_to_tlo_on, False, None, cascade_rules)
+
+    started = time.time()
+    rows = 0
+    nc.take_dedupe_stats()
+    vm.take_cascade_stats()
+
+    print("{} - Retrieving the report data".format(datetime.now()))
+
+    if chunksize is None:
+
+        # Read the data
+        with metrics.stage('read') as run:
+            df = read_tlo_file(file_to_analyze)
+            run['rows'] = len(df)
+
+        # Analyze it
+        df = analyze(df)
+        rows = len(df)
+
+        find_duplicates(df, True)
+
+        print("{} - Saving the results".format(datetime.now()))
+
+        # Export the results
+        with metrics.stage('write', rows):
+            report.write(df)
+
+        save_features(df)
+
+    else:
+
+        # Analyze the data a chunk at a time, appending each chunk to the report
+        chunks = read_tlo_file(file_to_analyze, chunksize=chunksize)
+        while True:
+            with metrics.stage('read') as run:
+                df = next(chunks, None)
+                run['rows'] = 0 if df is None else len(df)
+            if df is None:
+                break
+
+            print("{} - Analyzing rows {} to {}".format(datetime.now(), df.index[0], df.index[-1]))
+
+            first = rows == 0
+            df = analyze(df)
+            rows += len(df)
+
+            find_duplicates(df, first)
+
+            print("{} - Saving the results".format(datetime.now()))
+
+            with metrics.stage('write', len(df)):
+                report.write(df)
+
+            save_features(df)
+
+    report.close()
+
+    if own_pool:
+        pool.shutdown()
+
+    if cache is not None:
+        cache.close()
+        print("{} - Score cache: {} hits, {} misses".format(datetime.now(), cache.hits, cache.misses))
+
+    if duplicates is not None:
+        duplicates.close()
+        print("{} - Duplicate claimants: {} found in {} candidate pairs, saved to {}".format(
+            datetime.now(), duplicates.duplicates, duplicates.compared, duplicates_file))
+
+    # How much fuzzy scoring was saved by scoring each distinct pair of names only once
+    dedupe = nc.take_dedupe_stats()
+    print("{} - Fuzzy scoring: {} of {} scores computed, {:.0%} were repeats".format(
+        datetime.now(), dedupe['scored'], dedupe['pairs'], 1 - dedupe['scored'] / dedupe['pairs'] if dedupe['pairs'] else 0))
+
+    # How many records the cascade verified without the classifier
+    cascaded = vm.take_cascade_stats()
+    if cascade:
+        print("{} - Cascade: {} of {} records ({:.1%}) were verified by rule and skipped the classifier".format(
+            datetime.now(), cascaded['skipped'], cascaded['records'],
+            cascaded['skipped'] / cascaded['records'] if cascaded['records'] else 0))
+
+    if store is not None:
+        print("{} - Feature store: {} of {} records saved to {} ({} in all)".format(
+            datetime.now(), stored['rows'], rows, feature_store, store.rows))
+
+    elapsed = time.time() - started
+    print("{} - Analyzed {} rows in {:.1f}s ({:.0f} rows/sec with {} worker(s))".format(
+        datetime.now(), rows, elapsed, rows / elapsed if elapsed else 0, workers))
+
+    # Save the run summary, and the profile, next to the report
+    summary = metrics.write_summary(summary_file, rows,
+                          file=file_to_analyze, report_type=report_type, report_file=report_file,
+                          report_format=report_format, report_columns=report_columns,
+                          workers=workers, chunksize=chunksize,
+                          cache_hits=cache.hits if cache is not None else None,
+                          cache_misses=cache.misses if cache is not None else None,
+                          duplicates=duplicates.duplicates if duplicates is not None else None,
+                          cascade_records=cascaded['records'] if cascade else None,
+                          cascade_skipped=cascaded['skipped'] if cascade else None,
+                          feature_store_rows=store.rows if store is not None else None,
+                          feature_store_saved=stored['rows'] if store is not None else None,
+                          feature_store_error=stored['error'],
+                          fuzzy_scores_requested=dedupe['pairs'], fuzzy_scores_computed=dedupe['scored'])
+    print("{} - Saved the run summary to {}".format(datetime.now(), summary_file))
+
+    if profile_stage:
+        if metrics.write_profile(profile_file):
+            print("{} - Saved the profile of the {} stage to {}".format(datetime.now(), profile_stage, profile_file))
+        else:
+            print("{} - The {} stage didn't run, so there is no profile".format(datetime.now(), profile_stage))
 
     ##
     # Clean Up
@@ -425,11 +761,168 @@ def process_tlo_file(file_to_process, type_of_file):
 
     print("{} - Report generation complete and the report is ready for review.\n".format(datetime.now()))
 
+    return summary
+
+
+def find_tlo_files(drop_dir):
+    """
+    Finds the TLO files waiting in a drop directory, which has a folder for each type of report: <drop_dir>/<type>/*.csv
+    :return: list of (file, type), in name order
+    """
+    files = []
+    for report_type in sorted(os.listdir(drop_dir)):
+        type_dir = os.path.join(drop_dir, report_type)
+        if os.path.isdir(type_dir):
+            files += [(os.path.join(type_dir, name), report_type)
+                      for name in sorted(os.listdir(type_dir)) if name.lower().endswith('.csv')]
+    return files
+
+
+def process_tlo_file_group(files, options):
+    """
+    Runs process_tlo_file on files one after another, carrying on past files that fail
+    :return: list of (file, type, run summary or None, error or None)
+    """
+    results = []
+    for file_to_process, type_of_file in files:
+        try:
+            results.append((file_to_process, type_of_file, process_tlo_file(file_to_process, type_of_file, **options), None))
+        except Exception as e:
+            print("{} - Couldn't analyze {}: {!r}".format(datetime.now(), file_to_process, e))
+            results.append((file_to_process, type_of_file, None, e))
+        sys.stdout.flush()
+    return results
+
+
+def process_tlo_files(files, parallel_files=1, workers=1, **options):
+    """
+    Runs the TLO analysis on a batch of TLO files in one process, loading the suffix table and the classifier once.
+    Each file gets the same report and is moved the same way as when it's analyzed on its own
+    :param files: list of (file, type)
+    :param parallel_files: if more than 1, the number of worker processes to analyze files in at the same time.
+                           Files of the same type share a report, so they are analyzed one after another
+    :param workers: the number of processes to split each file across, when files are analyzed one at a time
+    :param options: the other options of process_tlo_file
+    :return: list of (file, type, run summary or None, error or None)
+    """
+    started = time.time()
+
+    # Files of the same type are saved to the same report, so the last one analyzed wins
+    by_type = collections.OrderedDict()
+    for file_to_process, type_of_file in files:
+        by_type.setdefault(type_of_file, []).append((file_to_process, type_of_file))
+    for type_of_file, group in by_type.items():
+        if len(group) > 1:
+            print("{} - Warning: {} files are of type {}; each replaces the {} report of the one before".format(
+                datetime.now(), len(group), type_of_file, type_of_file))
+
+    print("{} - Analyzing a batch of {} TLO files".format(datetime.now(), len(files)))
+
+    # Index the claimants of earlier reports once for the batch, not once per file
+    if options.get('duplicates_index') and options.get('index_existing_reports'):
+        config = configparser.ConfigParser()
+        config.read('config/config.ini')
+        duplicates = dc.DuplicateIndex(options['duplicates_index'])
+        print("{} - Indexed {} claimants of earlier reports".format(
+            datetime.now(), dc.index_reports(duplicates, config['TLO']['tlo_file_path'])))
+        duplicates.close()
+        options = dict(options, index_existing_reports=False)
+
+    if parallel_files > 1 and len(by_type) > 1:
+        with ProcessPoolExecutor(max_workers=min(parallel_files, len(by_type)), initializer=init_worker) as pool:
+            groups = [pool.submit(process_tlo_file_group, group, options) for group in by_type.values()]
+            results = [result for group in groups for result in group.result()]
+
+    else:
+        init_worker()
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker) if workers > 1 else None
+        try:
+            results = process_tlo_file_group(files, dict(options, workers=workers, pool=pool))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    failed = [result for result in results if result[3] is not None]
+    rows = sum(summary['rows'] for _, _, summary, _ in results if summary is not None)
+    print("{} - Analyzed {} of {} TLO files ({} rows) in {:.1f}s".format(
+        datetime.now(), len(results) - len(failed), len(results), rows, time.time() - started))
+    for file_to_process, _, _, error in failed:
+        print("{} - Failed: {} ({!r})".format(datetime.now(), file_to_process, error))
+
+    return results
+
 
 def main():
-    file_to_process = sys.argv[1]
-    type_of_file = sys.argv[2]
-    process_tlo_file(file_to_process, type_of_file)
+    parser = argparse.ArgumentParser(description="Run the TLO analysis on a TLO file, or on a batch of them")
+    parser.add_argument("file_to_process", nargs="?", help="the TLO file to analyze")
+    parser.add_argument("type_of_file", nargs="?", help="the type of report, used in the report file name")
+    parser.add_argument("--pair", nargs=2, action="append", default=[], metavar=("FILE", "TYPE"),
+                        help="add a TLO file and its type to the batch; can be given many times")
+    parser.add_argument("--drop-dir", default=None,
+                        help="add the TLO files in a drop directory to the batch, <drop-dir>/<type>/*.csv")
+    parser.add_argument("--parallel-files", type=int, default=1,
+                        help="analyze this many files of different types at the same time, each in its own process")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="stream the file through the analysis this many rows at a time to bound memory use")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="split the analysis across this many processes")
+    parser.add_argument("--cache", dest="cache_file", default=None,
+                        help="SQLite file to cache scores in, so records seen in earlier runs aren't scored again")
+    parser.add_argument("--cache-max-entries", type=int, default=1000000,
+                        help="the most records to keep in the score cache (least recently used are evicted first)")
+    parser.add_argument("--cache-max-age-days", type=float, default=90,
+                        help="the number of days to keep records in the score cache")
+    parser.add_argument("--format", dest="report_format", choices=sorted(rw.report_formats), default="csv",
+                        help="the format to save the report in (parquet and feather need pyarrow)")
+    parser.add_argument("--columns", dest="report_columns", choices=sorted(rw.column_profiles), default="full",
+                        help="save every column of the analysis (full) or only the decision columns")
+    parser.add_argument("--compression", default=None,
+                        help="compression of the report: none, or gzip/bz2/xz for csv, snappy (default)/gzip/brotli/"
+                             "lz4/zstd for parquet, lz4 (default)/zstd for feather")
+    parser.add_argument("--duplicates-index", default=None,
+                        help="SQLite index of claimants to find duplicate claimants in (other claim numbers, this file "
+                             "or earlier ones); duplicates are saved next to the report")
+    parser.add_argument("--index-existing-reports", action="store_true",
+                        help="add the claimants of the reports already in the report folders to the duplicates index")
+    parser.add_argument("--cascade", action="store_true",
+                        help="verify the records the cascade rules decide without the classifier "
+                             "(calibrate the rules with tlo_model.py calibrate-cascade)")
+    parser.add_argument("--feature-store", default=None,
+                        help="folder of a feature store to append the keys and features of the records to, "
+                             "for training and rescoring later (see tlo_model.py)")
+    parser.add_argument("--profile-stage", choices=tlo_stages, default=None,
+                        help="profile this stage with cProfile and save the profile next to the report")
+    args = parser.parse_args()
+
+    options = dict(chunksize=args.chunksize, cache_file=args.cache_file, cache_max_entries=args.cache_max_entries,
+                   cache_max_age_days=args.cache_max_age_days, profile_stage=args.profile_stage,
+                   report_format=args.report_format, report_columns=args.report_columns,
+                   compression=args.compression, duplicates_index=args.duplicates_index,
+                   index_existing_reports=args.index_existing_reports, cascade=args.cascade,
+                   feature_store=args.feature_store)
+
+    if not args.pair and not args.drop_dir:
+        if not args.type_of_file:
+            parser.error("give a TLO file and its type, --pair or --drop-dir")
+        process_tlo_file(args.file_to_process, args.type_of_file, workers=args.workers, **options)
+        return
+
+    # A batch of files
+    files = [tuple(pair) for pair in args.pair]
+    if args.file_to_process:
+        if not args.type_of_file:
+            parser.error("give the type of {}".format(args.file_to_process))
+        files.insert(0, (args.file_to_process, args.type_of_file))
+    if args.drop_dir:
+        files += find_tlo_files(args.drop_dir)
+
+    if not files:
+        print("{} - No TLO files to analyze".format(datetime.now()))
+        return
+
+    results = process_tlo_files(files, parallel_files=args.parallel_files, workers=args.workers, **options)
+    if any(error is not None for _, _, _, error in results):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
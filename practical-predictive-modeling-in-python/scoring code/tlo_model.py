@@ -0,0 +1,540 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+tlo_model.py
+Created on 10/18/2026
+
+Tools for the classifier that verifies TLO records.
+
+Train a classifier on labeled records (the reviewed training data; reports and feature stores hold the
+classifier's own verifications, so they are refused), a chunk at a time so the data doesn't have to fit in memory, and save it with its test metrics:
+    python tlo_model.py train --data "../data/tlo_checks_*_cleaned.csv"
+
+Tune the classifier's C, penalty and class weights with k-fold cross-validation, the grid and folds running
+across a few processes that share the feature matrix (built once, and memory-mapped):
+    python tlo_model.py tune --C 0.1 1 10 --penalty l1 l2 --folds 5
+
+Apply a new classifier to every report in the daily report folders, across processes, and save the records
+whose verification changed:
+    python tlo_model.py backfill --classifier models/tlo_lr_classifier_MM.DD.YY.npz --output changed.csv
+
+Export the pickled classifier to an .npz file that tlo_checker.py scores with NumPy alone, checking that it
+verifies the training data the same way:
+    python tlo_model.py export
+
+Calibrate the cascade rules against the classifier on the training data (see tlo_checker.py --cascade):
+    python tlo_model.py calibrate-cascade
+
+See how often the cascade agrees with the classifier, and how many records skip it, on scored records
+(the training data or a full report):
+    python tlo_model.py evaluate-cascade --data [SCORED_CSV]
+"""
+
+import argparse
+import configparser
+import glob
+import json
+import os
+import sys
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+import bin.report_writers as rw
+import bin.training_data as td
+import bin.tlo_verification_and_matching as vm
+
+
+# The columns of a report that the backfill reads: the claim number, the features and the verification to compare with
+backfill_columns = ['claim_number'] + vm.model_features + ['verified']
+
+# The columns of the backfill's file of changed verifications
+backfill_diff_columns = ['report_file', 'row', 'claim_number', 'verified_before', 'verified_after']
+
+# The feature matrix, targets and folds of a tuning worker, memory-mapped from the training data cache
+_tuning_data = {}
+
+# The number of tuning processes when not asked for more: each fit holds its own copies of its training records
+# (see tune_command), so memory, not CPUs, is what runs out first
+default_tuning_workers = min(4, os.cpu_count() or 1)
+
+
+def find_data_files(patterns):
+    """
+    Returns the data files matching any of the glob patterns, exiting when there are none
+    """
+    data_files = sorted(set(data_file for pattern in patterns for data_file in glob.glob(pattern)))
+    if not data_files:
+        sys.exit("No data files match {}".format(" ".join(patterns)))
+    return data_files
+
+
+def train_classifier(data_files, chunksize=td.default_chunksize, epochs=5, alpha=0.0001, test_size=0.2, seed=111):
+    """
+    Trains a logistic regression classifier with stochastic gradient descent, a chunk of labeled records at a time.
+    The features are standardized for training, and the scaling is folded back into the coefficients so the
+    classifier takes the scores as they are
+    :param data_files: the CSV files of labeled records
+    :param chunksize: the number of records to read at a time
+    :param epochs: the number of passes over the training records
+    :param alpha: the strength of the regularization
+    :param test_size: the share of records held out for testing
+    :param seed: the seed of the hold-out and of the training
+    :return: the classifier, as a vm.LinearClassifier
+    """
+    def chunks():
+        return td.stream_training_data(data_files, chunksize, test_size, seed)
+
+    # The first pass works out the mean and standard deviation of each feature on the training records
+    count = 0
+    sums = np.zeros(len(vm.model_features))
+    squares = np.zeros(len(vm.model_features))
+    for feature_matrix, _, held_out in chunks():
+        train = feature_matrix[~held_out]
+        count += len(train)
+        sums += train.sum(axis=0)
+        squares += (train ** 2).sum(axis=0)
+    if count == 0:
+        raise ValueError("No labeled records to train on in {}".format(", ".join(data_files)))
+
+    mean = sums / count
+    scale = np.sqrt(np.maximum(squares / count - mean ** 2, 0))
+    scale[scale == 0] = 1
+
+    model = SGDClassifier(loss='log_loss', alpha=alpha, random_state=seed)
+    rng = np.random.RandomState(seed)
+    for epoch in range(epochs):
+        for feature_matrix, targets, held_out in chunks():
+            order = rng.permutation(int((~held_out).sum()))
+            model.partial_fit(((feature_matrix[~held_out] - mean) / scale)[order], targets[~held_out][order],
+                              classes=[0, 1])
+        print("{} - Finished epoch {} of {}".format(datetime.now(), epoch + 1, epochs))
+
+    # Fold the scaling into the coefficients: w . (x - mean) / scale + b = (w / scale) . x + b - w . mean / scale
+    coef = model.coef_.ravel() / scale
+    return vm.LinearClassifier(coef, model.intercept_[0] - coef @ mean, model.classes_, vm.model_features)
+
+
+def test_classifier(classifier, data_files, chunksize=td.default_chunksize, test_size=0.2, seed=111,
+                    current_classifier=None):
+    """
+    Tests a classifier on the records held out of training
+    :param current_classifier: the classifier in use, to compare with, if any
+    :return: dict of metrics: the accuracy, precision and recall and the confusion matrix (rows are the actual
+             verifications, columns the predicted ones), and how often the classifier agrees with the current one
+    """
+    confusion = np.zeros((2, 2), dtype=np.int64)
+    agree = 0
+    for feature_matrix, targets, held_out in td.stream_training_data(data_files, chunksize, test_size, seed):
+        predicted = classifier.predict(feature_matrix[held_out]).astype(int)
+        np.add.at(confusion, (targets[held_out], predicted), 1)
+        if current_classifier is not None:
+            agree += int((current_classifier.predict(feature_matrix[held_out]).astype(int) == predicted).sum())
+
+    tested = int(confusion.sum())
+    return {
+        'test_records': tested,
+        'accuracy': float(np.trace(confusion) / tested) if tested else None,
+        'precision': float(confusion[1, 1] / confusion[:, 1].sum()) if confusion[:, 1].sum() else None,
+        'recall': float(confusion[1, 1] / confusion[1, :].sum()) if confusion[1, :].sum() else None,
+        'confusion_matrix': confusion.tolist(),
+        'agreement_with_current_model': float(agree / tested) if tested and current_classifier is not None else None,
+    }
+
+
+def train_command(args):
+    data_files = find_data_files(args.data)
+
+    print("{} - Training on {} file(s): {}".format(datetime.now(), len(data_files), ", ".join(data_files)))
+    started = time.time()
+    classifier = train_classifier(data_files, args.chunksize, args.epochs, args.alpha, args.test_size, args.seed)
+    training_seconds = time.time() - started
+
+    current = vm.load_classifier(args.current) if args.current and os.path.exists(args.current) else None
+    metrics = test_classifier(classifier, data_files, args.chunksize, args.test_size, args.seed, current)
+    metrics.update(data_files=data_files, trained_on=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                   training_seconds=round(training_seconds, 2), model_file=args.output,
+                   current_model_file=args.current if current is not None else None,
+                   chunksize=args.chunksize, epochs=args.epochs, alpha=args.alpha, test_size=args.test_size,
+                   seed=args.seed)
+
+    vm.save_classifier(classifier, args.output)
+    metrics_file = os.path.splitext(args.output)[0] + "_metrics.json"
+    with open(metrics_file, 'w') as f:
+        json.dump(metrics, f, indent=2)
+
+    print("{} - Accuracy {:.4f} on {} held out records; confusion matrix {}".format(
+        datetime.now(), metrics['accuracy'], metrics['test_records'], metrics['confusion_matrix']))
+    if current is not None:
+        print("{} - Agrees with {} on {:.2%} of them".format(datetime.now(), args.current,
+                                                            metrics['agreement_with_current_model']))
+    print("{} - Saved the classifier to {} and its metrics to {}".format(datetime.now(), args.output, metrics_file))
+
+
+def assign_folds(targets, folds, seed=111):
+    """
+    Assigns each record to one of the cross-validation folds, each fold getting its share of each class
+    :return: an array with the fold of each record
+    """
+    rng = np.random.RandomState(seed)
+    assigned = np.zeros(len(targets), dtype=np.int8)
+    for label in np.unique(targets):
+        records = np.flatnonzero(targets == label)
+        assigned[rng.permutation(records)] = np.arange(len(records)) % folds
+    return assigned
+
+
+def init_tuning_worker(cache_dir, folds):
+    """
+    Memory-maps the feature matrix and targets of the training data cache in a tuning worker, once, so every job of
+    the worker (and every worker) reads the same pages rather than loading its own copy
+    :param folds: the fold of each record (see assign_folds)
+    """
+    _tuning_data['features'] = np.load(os.path.join(cache_dir, "features.npy"), mmap_mode='r')
+    _tuning_data['targets'] = np.load(os.path.join(cache_dir, "targets.npy"), mmap_mode='r')
+    _tuning_data['folds'] = folds
+
+
+def run_tuning_job(config, fold, seed=111):
+    """
+    Trains a classifier with a configuration on every fold but one and tests it on that one
+    :param config: dict of the C, penalty and class_weight of the LogisticRegression
+    :param fold: the fold to test on
+    :return: dict of the configuration, the fold, the accuracy, precision and recall and the seconds to fit
+    """
+    features, targets, folds = _tuning_data['features'], _tuning_data['targets'], _tuning_data['folds']
+
+    # Gathering the records of the other folds copies them out of the shared matrix (and liblinear copies them
+    # again), so only one fit's worth is held per worker at a time
+    train = np.flatnonzero(folds != fold)
+    test = np.flatnonzero(folds == fold)
+
+    started = time.time()
+    model = LogisticRegression(solver='liblinear', random_state=seed, **config).fit(features[train], targets[train])
+    fit_seconds = time.time() - started
+
+    actual = np.asarray(targets[test])
+    predicted = model.predict(features[test])
+    true_positives = int(((predicted == 1) & (actual == 1)).sum())
+    return {
+        'config': config,
+        'fold': fold,
+        'accuracy': float((predicted == actual).mean()),
+        'precision': true_positives / int((predicted == 1).sum()) if (predicted == 1).any() else 0.0,
+        'recall': true_positives / int((actual == 1).sum()) if (actual == 1).any() else 0.0,
+        'fit_seconds': fit_seconds,
+    }
+
+
+def rank_configs(results):
+    """
+    Averages the results of each configuration over its folds and ranks the configurations by mean accuracy
+    :return: list of dicts, best first
+    """
+    by_config = {}
+    for result in results:
+        by_config.setdefault(json.dumps(result['config'], sort_keys=True), []).append(result)
+
+    ranked = []
+    for config_results in by_config.values():
+        accuracies = np.array([result['accuracy'] for result in config_results])
+        ranked.append({
+            'config': config_results[0]['config'],
+            'folds': len(config_results),
+            'accuracy': float(accuracies.mean()),
+            'accuracy_std': float(accuracies.std()),
+            'precision': float(np.mean([result['precision'] for result in config_results])),
+            'recall': float(np.mean([result['recall'] for result in config_results])),
+            'fit_seconds': float(np.mean([result['fit_seconds'] for result in config_results])),
+        })
+
+    return sorted(ranked, key=lambda config: (-config['accuracy'], config['accuracy_std']))
+
+
+def tune_command(args):
+    data_files = find_data_files(args.data)
+
+    started = time.time()
+    features, targets = td.cache_training_data(data_files, args.cache_dir, args.chunksize)
+    print("{} - {} records from {} file(s) cached in {} ({:.1f}s)".format(
+        datetime.now(), len(targets), len(data_files), args.cache_dir, time.time() - started))
+
+    folds = assign_folds(targets, args.folds, args.seed)
+    configs = [{'C': C, 'penalty': penalty, 'class_weight': None if class_weight == 'none' else class_weight}
+               for C, penalty, class_weight in itertools.product(args.C, args.penalty, args.class_weight)]
+    jobs = [(config, fold) for config in configs for fold in range(args.folds)]
+    print("{} - Running {} configurations x {} folds = {} fits on {} worker(s)".format(
+        datetime.now(), len(configs), args.folds, len(jobs), args.workers))
+
+    # Each fit gathers its training records out of the shared matrix and liblinear makes its own copy of them, so
+    # every worker holds about twice the training records of a fold on top of the shared, memory-mapped matrix
+    fit_bytes = 2 * features[0:1].nbytes * int((folds != 0).sum())
+    print("{} - Each fit holds about {:.0f} MB, {:.0f} MB across the workers".format(
+        datetime.now(), fit_bytes / 2 ** 20, args.workers * fit_bytes / 2 ** 20))
+
+    started = time.time()
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_tuning_worker,
+                                 initargs=(args.cache_dir, folds)) as pool:
+            results = list(pool.map(run_tuning_job, *zip(*jobs), itertools.repeat(args.seed)))
+    else:
+        init_tuning_worker(args.cache_dir, folds)
+        results = [run_tuning_job(config, fold, args.seed) for config, fold in jobs]
+    print("{} - Finished in {:.1f}s".format(datetime.now(), time.time() - started))
+
+    ranked = rank_configs(results)
+    print("  rank       C  penalty  class_weight  accuracy (std)      precision  recall  fit s")
+    for rank, config in enumerate(ranked, 1):
+        print("  {:>4}  {:>6g}  {:>7}  {:>12}  {:.4f} ({:.4f})     {:.4f}     {:.4f}  {:>5.2f}".format(
+            rank, config['config']['C'], config['config']['penalty'], str(config['config']['class_weight']),
+            config['accuracy'], config['accuracy_std'], config['precision'], config['recall'],
+            config['fit_seconds']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'data_files': data_files, 'folds': args.folds, 'seed': args.seed, 'ranked': ranked}, f, indent=2)
+        print("{} - Saved the results to {}".format(datetime.now(), args.output))
+
+
+def backfill_report(report_file, classifier_file):
+    """
+    Verifies the records of a report again with a classifier, all at once
+    :param report_file: a full report, in any of the report formats
+    :param classifier_file: the classifier to verify with
+    :return: (the number of records, data frame of the records whose verification changed, with the
+             backfill_diff_columns)
+    """
+    df = rw.read_report(report_file, backfill_columns, dtype={'claim_number': str})
+    missing = [column for column in backfill_columns if column not in df.columns]
+    if missing:
+        raise ValueError("{} doesn't have the columns to verify its records (is it a decision report?): {}".format(
+            report_file, ", ".join(missing)))
+
+    before = df['verified'].values.astype(np.uint8)
+    after = vm.verify_records(td.prepare_features(df), classifier_file)
+    changed = before != after
+
+    return len(df), pd.DataFrame({
+        'report_file': report_file,
+        'row': df.index[changed],
+        'claim_number': df['claim_number'].values[changed],
+        'verified_before': before[changed],
+        'verified_after': after[changed],
+    }, columns=backfill_diff_columns)
+
+
+def backfill_command(args):
+    if args.reports:
+        base_path = args.reports
+    else:
+        config = configparser.ConfigParser()
+        config.read('config/config.ini')
+        base_path = config['TLO']['tlo_file_path']
+
+    report_files = rw.find_reports(base_path)
+    if not report_files:
+        sys.exit("No reports in {}".format(base_path))
+    print("{} - Verifying the records of {} reports in {} again with {} on {} worker(s)".format(
+        datetime.now(), len(report_files), base_path, args.classifier, args.workers))
+
+    started = time.time()
+    if args.workers > 1:
+        pool = ProcessPoolExecutor(max_workers=args.workers)
+        futures = [pool.submit(backfill_report, report_file, args.classifier) for report_file in report_files]
+    else:
+        pool = None
+
+    records = 0
+    changes = []
+    failed = []
+    for i, report_file in enumerate(report_files):
+        try:
+            if pool is not None:
+                report_records, changed = futures[i].result()
+            else:
+                report_records, changed = backfill_report(report_file, args.classifier)
+        except Exception as e:
+            print("{} - Couldn't verify {}: {!r}".format(datetime.now(), report_file, e))
+            failed.append(report_file)
+            continue
+        records += report_records
+        changes.append(changed)
+        print("{} - {}: {} of {} records changed".format(datetime.now(), report_file, len(changed), report_records))
+
+    if pool is not None:
+        pool.shutdown()
+
+    diff = pd.concat(changes, ignore_index=True) if changes else pd.DataFrame(columns=backfill_diff_columns)
+    diff.to_csv(args.output, index=False)
+
+    elapsed = time.time() - started
+    print("{} - {} of {} records in {} reports changed ({} now verified, {} no longer verified) in {:.1f}s "
+          "({:.0f} records/sec); saved them to {}".format(
+              datetime.now(), len(diff), records, len(report_files) - len(failed),
+              int((diff['verified_after'] == 1).sum()), int((diff['verified_after'] == 0).sum()),
+              elapsed, records / elapsed if elapsed else 0, args.output))
+
+    if failed:
+        print("{} - {} reports couldn't be verified".format(datetime.now(), len(failed)))
+        sys.exit(1)
+
+
+def export_command(args):
+    print("{} - Exporting {} to {}".format(datetime.now(), args.classifier, args.output))
+    classifier = vm.load_classifier(args.classifier)
+    exported = vm.export_classifier(classifier, args.output, args.classifier)
+
+    # Check the exported model against the pickled one on the training data
+    feature_matrix, _ = td.load_training_data(args.data)
+    started = time.time()
+    expected = classifier.predict(feature_matrix)
+    pickled_seconds = time.time() - started
+    reloaded = vm.load_exported_classifier(args.output)
+    started = time.time()
+    predicted = reloaded.predict(feature_matrix)
+    exported_seconds = time.time() - started
+
+    differences = int((expected != predicted).sum())
+    largest = float(np.abs(classifier.decision_function(feature_matrix) -
+                           exported.decision_function(feature_matrix)).max()) if len(feature_matrix) else 0.0
+    print("{} - Checked on {} records: {} verifications differ, largest decision difference {:.2e}; "
+          "{:.4f}s with the pickled model, {:.4f}s exported".format(datetime.now(), len(feature_matrix), differences,
+                                                                    largest, pickled_seconds, exported_seconds))
+    if differences:
+        sys.exit(1)
+
+
+def evaluate_cascade(feature_matrix, cascade_rules, classifier_file=vm.tlo_classifier_file):
+    """
+    Compares the cascade with verifying every record with the classifier
+    :return: dict with the number of records, the share that skipped the classifier and the share the cascade
+             and the classifier agree on
+    """
+    full = vm.verify_records(feature_matrix, classifier_file)
+    vm.take_cascade_stats()
+    cascade = vm.verify_records_cascade(feature_matrix, cascade_rules, classifier_file)
+    stats = vm.take_cascade_stats()
+
+    return {
+        'records': len(feature_matrix),
+        'skipped': stats['skipped'] / stats['records'] if stats['records'] else 0.0,
+        'agreement': float((full == cascade).mean()) if len(full) else 1.0,
+        'disagreements': int((full != cascade).sum()),
+    }
+
+
+def print_cascade_evaluation(evaluation):
+    print("{} - Cascade on {} records: {:.1%} skipped the classifier, {:.3%} agree with the classifier "
+          "({} disagree)".format(datetime.now(), evaluation['records'], evaluation['skipped'],
+                                 evaluation['agreement'], evaluation['disagreements']))
+
+
+def calibrate_cascade_command(args):
+    print("{} - Calibrating the cascade on {}".format(datetime.now(), args.data))
+    feature_matrix, _ = td.load_training_data(args.data)
+    rules = vm.calibrate_cascade(feature_matrix, args.classifier, args.min_agreement, args.min_support)
+
+    print("  ssn dob name   records  verified  agreement  rule")
+    for rule in rules:
+        print("  {:>3} {:>3} {:>4}  {:>8}  {:>8}  {:>9.2%}  {}".format(
+            rule['ssn_match'], rule['dob_match'], rule['name_match'], rule['records'], rule['verified'],
+            rule['agreement'], 'yes' if rule['use'] else 'no'))
+
+    vm.save_cascade_rules(rules, args.rules, args.classifier)
+    print("{} - Saved the cascade rules to {}".format(datetime.now(), args.rules))
+
+    print_cascade_evaluation(evaluate_cascade(feature_matrix, vm.load_cascade_rules(args.rules, args.classifier), args.classifier))
+
+
+def evaluate_cascade_command(args):
+    feature_matrix, _ = td.load_training_data(args.data)
+    print_cascade_evaluation(evaluate_cascade(feature_matrix, vm.load_cascade_rules(args.rules, args.classifier), args.classifier))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tools for the classifier that verifies TLO records")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    train = commands.add_parser("train", help="train a classifier on labeled records, a chunk at a time")
+    train.add_argument("--data", nargs="+", default=[td.training_file],
+                       help="CSV files (or glob patterns) of reviewed, labeled records such as the training data; "
+                            "reports and feature stores are refused")
+    train.add_argument("--output", default=os.path.join(vm.models_dir, "tlo_lr_classifier_{}.npz".format(
+                           datetime.now().strftime("%m.%d.%y"))),
+                       help="the .npz file to save the classifier to; its metrics are saved next to it")
+    train.add_argument("--current", default=vm.tlo_classifier_file, help="the classifier in use, to compare with")
+    train.add_argument("--chunksize", type=int, default=td.default_chunksize,
+                       help="the number of records to read at a time")
+    train.add_argument("--epochs", type=int, default=5, help="the number of passes over the training records")
+    train.add_argument("--alpha", type=float, default=0.0001, help="the strength of the regularization")
+    train.add_argument("--test-size", type=float, default=0.2, help="the share of records held out for testing")
+    train.add_argument("--seed", type=int, default=111, help="the seed of the hold-out and of the training")
+    train.set_defaults(run=train_command)
+
+    tune = commands.add_parser("tune", help="tune the classifier with k-fold cross-validation across processes")
+    tune.add_argument("--data", nargs="+", default=[td.training_file],
+                      help="CSV files (or glob patterns) of reviewed, labeled records such as the training data; "
+                           "reports and feature stores are refused")
+    tune.add_argument("--cache-dir", default=os.path.join(vm.models_dir, "training_cache"),
+                      help="the folder to cache the feature matrix and targets in, as .npy files")
+    tune.add_argument("--C", nargs="+", type=float, default=[0.01, 0.1, 1, 10, 100],
+                      help="the inverse regularization strengths to try")
+    tune.add_argument("--penalty", nargs="+", choices=['l1', 'l2'], default=['l1', 'l2'],
+                      help="the penalties to try")
+    tune.add_argument("--class-weight", nargs="+", choices=['none', 'balanced'], default=['none', 'balanced'],
+                      help="the class weights to try")
+    tune.add_argument("--folds", type=int, default=5, help="the number of cross-validation folds")
+    tune.add_argument("--workers", type=int, default=default_tuning_workers,
+                      help="the number of processes to fit in; each holds about twice the training records of a fold")
+    tune.add_argument("--chunksize", type=int, default=td.default_chunksize,
+                      help="the number of records to read at a time while building the cache")
+    tune.add_argument("--seed", type=int, default=111, help="the seed of the folds and of the training")
+    tune.add_argument("--output", help="a JSON file to save the ranked results to")
+    tune.set_defaults(run=tune_command)
+
+    backfill = commands.add_parser("backfill",
+                                   help="verify the records of every report again with a classifier and save the "
+                                        "ones that changed")
+    backfill.add_argument("--classifier", default=vm.tlo_classifier_file,
+                          help="the classifier to verify with: pickled or exported")
+    backfill.add_argument("--reports", default=None,
+                          help="the folder of the daily report folders; tlo_file_path of config/config.ini by default")
+    backfill.add_argument("--output", default="backfill_changes.csv",
+                          help="the CSV file to save the records whose verification changed to")
+    backfill.add_argument("--workers", type=int, default=os.cpu_count(),
+                          help="the number of processes to verify reports in")
+    backfill.set_defaults(run=backfill_command)
+
+    export = commands.add_parser("export", help="export the pickled classifier to an .npz file scored with NumPy")
+    export.add_argument("--classifier", default=vm.pickled_classifier_file, help="the pickled classifier")
+    export.add_argument("--output", default=vm.exported_classifier_file, help="the .npz file to export it to")
+    export.add_argument("--data", default=td.training_file, help="CSV of scored records to check the export on")
+    export.set_defaults(run=export_command)
+
+    calibrate = commands.add_parser("calibrate-cascade",
+                                    help="work out the cascade rules that agree with the classifier")
+    calibrate.add_argument("--min-agreement", type=float, default=0.999,
+                           help="the share of a cell's records the classifier must decide the same way")
+    calibrate.add_argument("--min-support", type=int, default=50, help="the fewest records a cell needs for a rule")
+    calibrate.set_defaults(run=calibrate_cascade_command)
+
+    evaluate = commands.add_parser("evaluate-cascade",
+                                   help="compare the cascade with the classifier on scored records")
+    evaluate.set_defaults(run=evaluate_cascade_command)
+
+    for command in [calibrate, evaluate]:
+        command.add_argument("--data", default=td.training_file,
+                             help="CSV of scored records: the training data (the default) or a full report")
+        command.add_argument("--classifier", default=vm.tlo_classifier_file, help="the classifier: pickled or exported")
+        command.add_argument("--rules", default=vm.cascade_rules_file, help="the cascade rules file")
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
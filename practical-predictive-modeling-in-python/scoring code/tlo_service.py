@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+tlo_service.py
+Created on 10/18/2026
+
+Runs the TLO analysis as a long-running local service, so single claimants can be checked without starting
+Python and loading pandas, the suffix table and the classifier for every check. Requests that arrive within a
+few milliseconds of each other are analyzed together as one micro-batch.
+
+Start the service (over HTTP, or on a Unix socket with --socket):
+    python tlo_service.py serve --port 8742
+
+POST a record, with the columns of a TLO file, or a batch of them, to /score:
+    curl -d '{"records": [{"Type": "CO", "claim_number": "1", "first_name": "JOHN", ...}]}' localhost:8742/score
+and get back the same fields process_tlo_file saves in a report ("columns": "decision" for just the decision
+columns). GET /health says whether the service is up.
+
+Load test it:
+    python tlo_service.py load-test --port 8742 --requests 2000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import bin.report_writers as rw
+import bin.synthetic_tlo_data as synthetic
+import tlo_checker as tlo
+
+# How long to wait for more requests to join a micro-batch, and the most records in one
+default_batch_window_ms = 5
+default_max_batch_size = 512
+
+# The largest request body accepted
+max_body_size = 16 * 1024 * 1024
+
+# The fields of a record the analysis can't run without
+required_fields = ['first_name', 'last_name', 'ssn']
+
+
+class RequestError(Exception):
+    pass
+
+
+def records_frame(records):
+    """
+    Creates a data frame of TLO records that is the same as reading them from a TLO file: every column is text,
+    with empty and missing values as NaN
+    """
+    columns = synthetic.tlo_file_columns
+    rows = [[np.nan if record.get(column) in (None, '') else str(record[column]) for column in columns]
+            for record in records]
+    df = pd.DataFrame(rows, columns=columns, dtype=object)
+    return df.astype({column: tlo.tlo_file_dtypes[column] for column in columns if tlo.tlo_file_dtypes[column] != str})
+
+
+def validate_records(records):
+    """
+    Checks that every record has the fields the analysis needs, so one bad record is turned away on its own
+    rather than failing the micro-batch it would have joined
+    """
+    for i, record in enumerate(records):
+        missing = [field for field in required_fields if record.get(field) in (None, '')]
+        if missing:
+            raise RequestError("Record {} is missing {}".format(i, ", ".join(missing)))
+
+
+def project_records(results, columns):
+    """
+    Selects the fields of analyzed records in a column profile (see report_writers.column_profiles)
+    """
+    if rw.column_profiles[columns] is None:
+        return results
+    return [{column: result.get(column) for column in rw.column_profiles[columns]} for result in results]
+
+
+def analyze_records(records, columns='full'):
+    """
+    Runs the TLO analysis on records
+    :param records: list of dicts with the columns of a TLO file
+    :param columns: the column profile to return, full or decision (see report_writers.column_profiles)
+    :return: list of dicts with the fields of the report, one per record
+    """
+    df = tlo.analyze_tlo_data(records_frame(records), tlo.get_tlo_send_date(), verbose=False)
+    if rw.column_profiles[columns] is not None:
+        df = df[rw.column_profiles[columns]]
+    return json.loads(df.to_json(orient='records'))
+
+
+class MicroBatcher(object):
+    """
+    Gathers the records of requests that arrive close together into one batch and analyzes them together
+    batch_window_ms: how long to wait for more requests once one has arrived
+    max_batch_size: the most records in a batch
+    """
+    def __init__(self, batch_window_ms=default_batch_window_ms, max_batch_size=default_max_batch_size):
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.records = 0
+
+    async def analyze(self, records, columns='full'):
+        """
+        Queues records to be analyzed with the next batch
+        :return: the analyzed records
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((records, columns, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.batch_window
+
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            # Analyze the batch in a thread so the service keeps accepting requests
+            records = [record for item in batch for record in item[0]]
+            try:
+                analyzed = await loop.run_in_executor(None, analyze_records, records)
+            except Exception as e:
+                if len(batch) == 1:
+                    if not batch[0][2].done():
+                        batch[0][2].set_exception(e)
+                    continue
+                # Analyze each request on its own, so only the request that can't be analyzed fails
+                await self.analyze_separately(batch)
+                continue
+
+            self.batches += 1
+            self.records += len(records)
+
+            start = 0
+            for item_records, columns, future in batch:
+                results = analyzed[start:start + len(item_records)]
+                start += len(item_records)
+                if not future.done():
+                    future.set_result(project_records(results, columns))
+
+    async def analyze_separately(self, batch):
+        loop = asyncio.get_running_loop()
+        for item_records, columns, future in batch:
+            try:
+                analyzed = await loop.run_in_executor(None, analyze_records, item_records)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.records += len(item_records)
+            if not future.done():
+                future.set_result(project_records(analyzed, columns))
+
+
+##
+# HTTP
+##
+
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+
+def http_response(status, body, keep_alive=True):
+    payload = json.dumps(body).encode('utf-8')
+    headers = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+        status, reasons[status], len(payload), 'keep-alive' if keep_alive else 'close')
+    return headers.encode('ascii') + payload
+
+
+async def read_request(reader):
+    """
+    Reads an HTTP request
+    :return: (method, path, headers, body), or None when the client closed the connection
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode('ascii').split(' ', 2)
+    except ValueError:
+        raise RequestError("Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = headers.get('content-length', '0')
+    if not (length.isascii() and length.isdigit()):
+        raise RequestError("Invalid Content-Length: {}".format(length))
+    length = int(length)
+    if length > max_body_size:
+        raise RequestError("Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+def parse_score_request(body):
+    """
+    Gets the records and the column profile out of a /score request: a record, a list of records,
+    or {"records": [...], "columns": "full" or "decision"}
+    """
+    try:
+        request = json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise RequestError("The request body isn't JSON")
+
+    columns = 'full'
+    if isinstance(request, dict) and 'records' in request:
+        columns = request.get('columns', 'full')
+        records = request['records']
+    elif isinstance(request, dict):
+        records = [request]
+    else:
+        records = request
+
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise RequestError("Records must be JSON objects with the columns of a TLO file")
+    if columns not in rw.column_profiles:
+        raise RequestError("Unknown column profile: {}".format(columns))
+    validate_records(records)
+    return records, columns
+
+
+class TloService(object):
+    """
+    The TLO scoring service
+    """
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.started = time.time()
+
+    async def handle(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok', 'uptime_seconds': round(time.time() - self.started, 1),
+                         'batches': self.batcher.batches, 'records': self.batcher.records}
+        if path != '/score':
+            return 404, {'error': 'Not found: {}'.format(path)}
+        if method != 'POST':
+            return 405, {'error': 'POST records to /score'}
+
+        records, columns = parse_score_request(body)
+        if not records:
+            return 200, {'records': []}
+        return 200, {'records': await self.batcher.analyze(records, columns)}
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                    status, response = await self.handle(method, path.split('?')[0], body)
+                except RequestError as e:
+                    status, response, keep_alive = 400, {'error': str(e)}, False
+                except Exception as e:
+                    status, response, keep_alive = 500, {'error': repr(e)}, False
+
+                writer.write(http_response(status, response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8742, socket_path=None, batch_window_ms=default_batch_window_ms,
+                max_batch_size=default_max_batch_size):
+    """
+    Loads everything the analysis needs, once, and serves requests until stopped
+    """
+    print("{} - Loading the suffix table and the classifier".format(datetime.now()))
+    tlo.init_worker()
+
+    # Warm up pandas and the analysis on a record, so the first request isn't slow
+    analyze_records(list(dict(zip(synthetic.tlo_file_columns, map(str, record)))
+                         for record in synthetic.generate_tlo_records(1)))
+
+    batcher = MicroBatcher(batch_window_ms, max_batch_size)
+    service = TloService(batcher)
+    asyncio.get_running_loop().create_task(batcher.run())
+
+    if socket_path:
+        server = await asyncio.start_unix_server(service.serve_connection, path=socket_path)
+        print("{} - Serving the TLO analysis on {}".format(datetime.now(), socket_path))
+    else:
+        server = await asyncio.start_server(service.serve_connection, host, port)
+        print("{} - Serving the TLO analysis on http://{}:{}".format(datetime.now(), host, port))
+
+    async with server:
+        await server.serve_forever()
+
+
+##
+# Load test
+##
+
+async def load_test(host='127.0.0.1', port=8742, socket_path=None, requests=1000, concurrency=16, batch=1, seed=1):
+    """
+    Sends requests of synthetic records to the service from concurrent clients, each over its own connection
+    :return: dict with the latency percentiles (in ms) and the throughput
+    """
+    rng = random.Random(seed)
+    records = [dict(zip(synthetic.tlo_file_columns, map(str, record)))
+               for record in synthetic.generate_tlo_records(max(1000, batch * 10), seed)]
+    latencies = []
+    errors = 0
+    remaining = [requests]
+
+    async def client():
+        nonlocal errors
+        if socket_path:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            body = json.dumps({'records': rng.sample(records, batch)}).encode('utf-8')
+            started = time.perf_counter()
+            writer.write("POST /score HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n"
+                         "Content-Length: {}\r\n\r\n".format(host, len(body)).encode('ascii') + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if b' 200 ' not in status_line:
+                errors += 1
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'records_per_request': batch,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p90_ms': round(float(np.percentile(latencies, 90)), 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+        'max_ms': round(max(latencies), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the TLO analysis as a local service")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    for name, help_text in [("serve", "serve the TLO analysis"), ("load-test", "load test the service")]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--host", default="127.0.0.1", help="the host to serve on or connect to")
+        command.add_argument("--port", type=int, default=8742, help="the port to serve on or connect to")
+        command.add_argument("--socket", dest="socket_path", default=None,
+                             help="serve on, or connect to, this Unix socket instead of a port")
+
+    serve_command = commands.choices["serve"]
+    serve_command.add_argument("--batch-window-ms", type=float, default=default_batch_window_ms,
+                               help="how long to wait for more requests to join a micro-batch")
+    serve_command.add_argument("--max-batch-size", type=int, default=default_max_batch_size,
+                               help="the most records to analyze in one micro-batch")
+
+    load_test_command = commands.choices["load-test"]
+    load_test_command.add_argument("--requests", type=int, default=1000, help="the number of requests to send")
+    load_test_command.add_argument("--concurrency", type=int, default=16, help="the number of concurrent clients")
+    load_test_command.add_argument("--batch", type=int, default=1, help="the number of records in each request")
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.socket_path, args.batch_window_ms, args.max_batch_size))
+        except KeyboardInterrupt:
+            pass
+    else:
+        results = asyncio.run(load_test(args.host, args.port, args.socket_path, args.requests, args.concurrency,
+                                        args.batch))
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()